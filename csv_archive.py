@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+ Compressed CSV/TSV files and zip archives.
+
+ A gzip or zstd compressed file (data.csv.gz, data.tsv.zst) is listed like
+ any CSV/TSV file. A zip archive is listed like a directory, its members
+ have virtual paths made of the archive path followed by the member name
+ (archive.zip/sub/data.csv). Files are always read by streaming
+ decompression, nothing is extracted to disk.
+"""
+
+import csv
+import gzip
+import io
+import os
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# extensions of the archives listed like directories
+ARCHIVE_EXTENSIONS = ('.zip',)
+# extensions of the compressed files that can be read
+COMPRESSED_EXTENSIONS = ('.gz', '.zst') if zstandard is not None else ('.gz',)
+
+# errors raised while reading a file, compressed or not
+READ_ERRORS = (OSError, EOFError, UnicodeDecodeError, csv.Error, zipfile.BadZipFile)
+if zstandard is not None:
+    READ_ERRORS += (zstandard.ZstdError,)
+
+
+def data_name(path):
+    """The function returns the file name of a path without its compression extension (data.csv for data.csv.gz)"""
+    name = os.path.basename(path)
+    root, extension = os.path.splitext(name)
+    if extension in COMPRESSED_EXTENSIONS:
+        return root
+    return name
+
+
+def is_archive_file(file_name):
+    """The function checks if the given file name is a zip archive"""
+    return file_name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def split_archive_path(path):
+    """The function splits the virtual path of a zip archive member in (archive_path, member_name),
+    it returns (None, None) if the path isn't inside an archive"""
+    parts = path.split(os.sep)
+    for index in range(len(parts) - 1, 0, -1):
+        if is_archive_file(parts[index]):
+            archive_path = os.sep.join(parts[:index + 1])
+            if os.path.isfile(archive_path):
+                return archive_path, '/'.join(parts[index + 1:])
+    return None, None
+
+
+def source_stat(path):
+    """The function returns the os.stat_result of the file holding the data of path: the file itself,
+    or the archive of a member. It raises OSError like os.stat"""
+    try:
+        return os.stat(path)
+    except OSError:
+        archive_path, member = split_archive_path(path)
+        if archive_path is None:
+            raise
+        return os.stat(archive_path)
+
+
+def list_archive(dir_path):
+    """The function returns the sub directories and the files directly under dir_path, an archive or a directory
+    inside one, as virtual paths sorted by name. It raises OSError if the archive can't be read"""
+    if is_archive_file(dir_path) and os.path.isfile(dir_path):
+        archive_path, prefix = dir_path, ''
+    else:
+        archive_path, prefix = split_archive_path(dir_path)
+        if archive_path is None:
+            raise OSError(f'{dir_path} is not inside an archive')
+        prefix += '/'
+
+    dirs = set()
+    files = []
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            names = archive.namelist()
+    except zipfile.BadZipFile as error:
+        raise OSError(str(error))
+
+    for name in names:
+        if not name.startswith(prefix) or name == prefix:
+            continue
+        # first component under the listed directory
+        child, separator, _ = name[len(prefix):].partition('/')
+        if separator:
+            dirs.add(os.path.join(dir_path, child))
+        else:
+            files.append(os.path.join(dir_path, child))
+    return sorted(dirs, key=os.path.basename), sorted(files, key=os.path.basename)
+
+
+def open_binary(path):
+    """The function opens the data of path as a binary stream: the file itself, its decompressed content if it's
+    gzip or zstd compressed, or the decompressed content of an archive member"""
+    if not os.path.exists(path):
+        archive_path, member = split_archive_path(path)
+        if archive_path is not None:
+            archive = zipfile.ZipFile(archive_path)
+            try:
+                return _ArchiveMember(archive, archive.open(member))
+            except KeyError:
+                archive.close()
+                raise FileNotFoundError(path)
+
+    extension = os.path.splitext(path)[1]
+    if extension == '.gz':
+        return gzip.open(path, 'rb')
+    if extension == '.zst' and zstandard is not None:
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+class _ArchiveMember(io.BufferedReader):
+    """Stream of an archive member closing its archive when it's closed."""
+
+    def __init__(self, archive, member_file):
+        super().__init__(member_file)
+        self._archive = archive
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._archive.close()
+
+
+def gdal_path(path):
+    """The function returns the GDAL virtual file system path of compressed data, path itself if it isn't
+    compressed, or None if GDAL can't read it directly (zstd)"""
+    if not os.path.exists(path):
+        archive_path, member = split_archive_path(path)
+        if archive_path is not None:
+            return f'/vsizip/{archive_path}/{member}'
+
+    extension = os.path.splitext(path)[1]
+    if extension == '.gz':
+        return '/vsigzip/' + path
+    if extension == '.zst':
+        return None
+    return path
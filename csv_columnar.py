@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+ Columnar cache of the imported CSV/TSV files.
+
+ Every file is converted once to a compressed GeoParquet file, or to a
+ FlatGeobuf file when pyarrow or the GDAL Parquet driver is missing. The
+ cache file name is derived from the source path, size, modification time,
+ coordinates fields and CRS, so a cache file is fresh as long as it exists
+ and it's loaded instead of parsing the text file again.
+"""
+
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import struct
+
+from osgeo import ogr, osr
+
+from .csv_archive import data_name, source_stat
+from .csv_gpkg import OGR_FIELD_TYPES, write_rows
+from .csv_reader import iter_attribute_chunks
+
+# pyarrow is slow to import, it's only imported when a GeoParquet file is written
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# pyarrow type of the sampled field types
+ARROW_FIELD_TYPES = {'integer': 'int64', 'double': 'float64', 'text': 'string'}
+
+# name of the geometry column of the cache files
+GEOMETRY_COLUMN = 'geometry'
+
+
+def columnar_format():
+    """The function returns the extension of the cache files: parquet when pyarrow can write them and GDAL
+    can read them back, fgb otherwise"""
+    if HAS_PYARROW and ogr.GetDriverByName('Parquet') is not None:
+        return 'parquet'
+    return 'fgb'
+
+
+def point_wkb(x, y):
+    """The function returns the little endian WKB of a 2D point"""
+    return struct.pack('<BIdd', 1, 1, x, y)
+
+
+class ColumnarCache:
+    """Directory of columnar copies of CSV/TSV files keyed by source path and modification time."""
+
+    def __init__(self, cache_dir):
+        """Constructor.
+
+        :param cache_dir: Directory of the cache files, created if missing.
+        :type cache_dir: str
+        """
+        self.cache_dir = cache_dir
+        self.extension = columnar_format()
+
+    def _prefix(self, path):
+        """The function returns the part of the cache file names shared by all the versions of a file"""
+        return hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:20]
+
+    def cache_path(self, path, x_field, y_field, crs_wkt):
+        """The function returns the cache file path of the current version of a file, or None if it can't be read"""
+        try:
+            stat = source_stat(path)
+        except OSError:
+            return None
+        key = hashlib.sha1(json.dumps([stat.st_size, stat.st_mtime_ns, x_field, y_field, crs_wkt]).encode('utf-8'))
+        return os.path.join(self.cache_dir, f'{self._prefix(path)}_{key.hexdigest()[:12]}.{self.extension}')
+
+    def lookup(self, path, x_field, y_field, crs_wkt):
+        """The function returns the cache file of a file if it's fresh, None otherwise"""
+        cache_path = self.cache_path(path, x_field, y_field, crs_wkt)
+        if cache_path is not None and os.path.exists(cache_path):
+            return cache_path
+        return None
+
+    def convert(self, path, x_field, y_field, field_types, crs_wkt, source_field, is_canceled=None):
+        """The function streams a file into its cache file and returns the cache file path. field_types are the
+        (name, type) tuples of the file columns, source_field is appended to them. It returns None if it was
+        canceled or if the file can't be read, the stale cache files of the file are removed"""
+        cache_path = self.cache_path(path, x_field, y_field, crs_wkt)
+        if cache_path is None:
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # written under a temporary name keeping the extension, a cache file is always complete
+        temp_path = f'{os.path.splitext(cache_path)[0]}.tmp.{self.extension}'
+        try:
+            if self.extension == 'parquet':
+                done = self._write_parquet(temp_path, path, x_field, y_field, field_types, crs_wkt, source_field,
+                                           is_canceled)
+            else:
+                done = self._write_flatgeobuf(temp_path, path, x_field, y_field, field_types, crs_wkt, source_field,
+                                              is_canceled)
+            if not done:
+                return None
+            os.replace(temp_path, cache_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        # older versions of the file are useless now
+        for stale_path in glob.glob(os.path.join(self.cache_dir, self._prefix(path) + '_*')):
+            if stale_path != cache_path:
+                try:
+                    os.remove(stale_path)
+                except OSError:
+                    pass
+        return cache_path
+
+    def _write_parquet(self, cache_path, path, x_field, y_field, field_types, crs_wkt, source_field, is_canceled):
+        """The function writes the rows of a file in a zstd compressed GeoParquet file, it returns False if
+        it was canceled"""
+        import pyarrow
+        import pyarrow.parquet
+
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(crs_wkt)
+        geo_metadata = {
+            'version': '1.0.0',
+            'primary_column': GEOMETRY_COLUMN,
+            'columns': {GEOMETRY_COLUMN: {
+                'encoding': 'WKB',
+                'geometry_types': ['Point'],
+                'crs': json.loads(srs.ExportToPROJJSON()),
+            }},
+        }
+        columns = [(name, ARROW_FIELD_TYPES[field_type]) for name, field_type in field_types]
+        columns.append((source_field, 'string'))
+        schema = pyarrow.schema([(name, arrow_type) for name, arrow_type in columns]
+                                + [(GEOMETRY_COLUMN, pyarrow.binary())],
+                                metadata={'geo': json.dumps(geo_metadata)})
+
+        with pyarrow.parquet.ParquetWriter(cache_path, schema, compression='zstd') as writer:
+            for rows in iter_attribute_chunks(path, x_field, y_field, field_types):
+                if is_canceled is not None and is_canceled():
+                    return False
+                # one chunk is one row group, column by column
+                arrays = [[attributes[index] for _, _, attributes in rows] for index in range(len(columns))]
+                arrays.append([point_wkb(x, y) for x, y, _ in rows])
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(values, type=schema.field(index).type) for index, values in enumerate(arrays)],
+                    schema=schema))
+        return True
+
+    def _write_flatgeobuf(self, cache_path, path, x_field, y_field, field_types, crs_wkt, source_field, is_canceled):
+        """The function writes the rows of a file in a FlatGeobuf file with its packed spatial index,
+        it returns False if it was canceled"""
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(crs_wkt)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        dataset = ogr.GetDriverByName('FlatGeobuf').CreateDataSource(cache_path)
+        if dataset is None:
+            raise OSError(f"Can't create {cache_path}")
+        layer = dataset.CreateLayer(os.path.splitext(data_name(path))[0], srs, ogr.wkbPoint,
+                                    ['SPATIAL_INDEX=YES'])
+        for name, field_type in field_types:
+            layer.CreateField(ogr.FieldDefn(name, OGR_FIELD_TYPES[field_type]))
+        layer.CreateField(ogr.FieldDefn(source_field, ogr.OFTString))
+
+        try:
+            for rows in iter_attribute_chunks(path, x_field, y_field, field_types):
+                if is_canceled is not None and is_canceled():
+                    return False
+                write_rows(layer, rows)
+        finally:
+            # the index & header are written when the dataset is closed
+            layer = None
+            dataset = None
+        return True
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+ Persistent index of the scanned directories.
+
+ The listing of every scanned directory is stored in a SQLite database with
+ the modification time of the directory. A directory whose modification
+ time didn't change still has the same entries, so a rescan takes its
+ listing from the index instead of listing it again, see
+ csv_scanner.iter_rescan.
+"""
+
+import json
+import os
+
+from .csv_sqlite import SqliteStore
+
+
+class DirIndex(SqliteStore):
+    """SQLite backed index of directories listings keyed by path and modification time."""
+
+    CREATE_TABLE = ('CREATE TABLE IF NOT EXISTS listing ('
+                    'path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, dirs TEXT NOT NULL, files TEXT NOT NULL)')
+
+    def get(self, dir_path):
+        """The function returns the indexed (mtime, sub_dirs, files) of dir_path or None"""
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT mtime, dirs, files FROM listing WHERE path = ?', (dir_path,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), json.loads(row[2])
+
+    def put_many(self, listings):
+        """The function stores (dir_path, mtime, sub_dirs, files) listings in one transaction"""
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                'INSERT OR REPLACE INTO listing (path, mtime, dirs, files) VALUES (?, ?, ?, ?)',
+                [(path, mtime, json.dumps(dirs), json.dumps(files)) for path, mtime, dirs, files in listings])
+            conn.commit()
+
+    def delete_subtrees(self, dirs_paths):
+        """The function removes the listings of the given directories and of everything beneath them"""
+        with self._lock:
+            conn = self._connection()
+            for dir_path in dirs_paths:
+                # compared as they are, LIKE would ignore the case of the paths
+                prefix = dir_path + os.sep
+                conn.execute('DELETE FROM listing WHERE path = ? OR substr(path, 1, ?) = ?',
+                             (dir_path, len(prefix), prefix))
+            conn.commit()
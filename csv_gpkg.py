@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+ Streaming conversion of CSV/TSV files to GeoPackage tables.
+
+ Rows are inserted with OGR in large transactions, the spatial index of a
+ table is built once after all its rows are inserted, which is much faster
+ than updating the R-tree on every insert. Only one chunk of rows is held
+ in memory whatever the size of the files.
+"""
+
+import os
+import re
+
+from osgeo import ogr, osr
+
+from .csv_archive import READ_ERRORS
+from .csv_reader import iter_attribute_chunks
+
+# number of rows inserted in one transaction
+TRANSACTION_ROWS = 50000
+
+# OGR type of the sampled field types
+OGR_FIELD_TYPES = {'integer': ogr.OFTInteger64, 'double': ogr.OFTReal, 'text': ogr.OFTString}
+
+# name of the geometry column & of the feature id column of the tables
+GEOMETRY_COLUMN = 'geom'
+FID_COLUMN = 'fid'
+
+
+def table_field_names(names, reserved=()):
+    """The function returns the column names of fields in a table: a name used by the fid or geometry column,
+    by one of the reserved names or by a previous field gets a numbered suffix. SQLite compares the names
+    without their case"""
+    used = {name.lower() for name in (FID_COLUMN, GEOMETRY_COLUMN) + tuple(reserved)}
+    columns = []
+    for name in names:
+        name = name or 'field'
+        column = name
+        suffix = 1
+        while column.lower() in used:
+            suffix += 1
+            column = f'{name}_{suffix}'
+        used.add(column.lower())
+        columns.append(column)
+    return columns
+
+
+def write_rows(layer, rows):
+    """The function inserts (x, y, attributes) rows as point features of an OGR layer, attributes follow its fields.
+    It raises OSError if a row can't be inserted"""
+    definition = layer.GetLayerDefn()
+    for x, y, attributes in rows:
+        feature = ogr.Feature(definition)
+        for index, value in enumerate(attributes):
+            if value is None:
+                feature.SetFieldNull(index)
+            else:
+                feature.SetField(index, value)
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(x, y)
+        feature.SetGeometryDirectly(point)
+        if layer.CreateFeature(feature) != ogr.OGRERR_NONE:
+            raise OSError(f"Can't insert a row in {layer.GetName()}")
+
+
+class GeoPackageWriter:
+    """Writer of point tables into a GeoPackage, created if it doesn't exist."""
+
+    def __init__(self, gpkg_path, crs_wkt):
+        """Constructor.
+
+        :param gpkg_path: Path of the GeoPackage.
+        :type gpkg_path: str
+
+        :param crs_wkt: WKT of the CRS of the coordinates.
+        :type crs_wkt: str
+        """
+        self.gpkg_path = gpkg_path
+        driver = ogr.GetDriverByName('GPKG')
+        if os.path.exists(gpkg_path):
+            self.dataset = driver.Open(gpkg_path, 1)
+        else:
+            self.dataset = driver.CreateDataSource(gpkg_path)
+        if self.dataset is None:
+            raise OSError(f"Can't open GeoPackage {gpkg_path}")
+
+        self.srs = osr.SpatialReference()
+        self.srs.ImportFromWkt(crs_wkt)
+        # coordinates are always x then y
+        self.srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        # table being written, its column of the source files & its pending rows count
+        self.layer = None
+        self.table_name = None
+        self.source_column = None
+        self.pending_rows = 0
+
+    def unique_table_name(self, name):
+        """The function returns a valid table name based on name that isn't used in the GeoPackage yet"""
+        base_name = re.sub(r'\W+', '_', name).strip('_') or 'layer'
+        existing = {self.dataset.GetLayerByIndex(i).GetName().lower() for i in range(self.dataset.GetLayerCount())}
+        table_name = base_name
+        suffix = 1
+        while table_name.lower() in existing:
+            suffix += 1
+            table_name = f'{base_name}_{suffix}'
+        return table_name
+
+    def create_table(self, name, field_types, source_field):
+        """The function creates a point table with the given fields, a list of (name, type) tuples,
+        followed by the source_field text field. The fields named like the fid or geometry column (e.g. a fid
+        column exported by QGIS) or like source_field are renamed, see table_field_names. It returns the name
+        given to the table, it raises OSError if the table can't be created"""
+        self.table_name = self.unique_table_name(name)
+        # the spatial index is built once the table is filled
+        self.layer = self.dataset.CreateLayer(
+            self.table_name, self.srs, ogr.wkbPoint,
+            ['SPATIAL_INDEX=NO', f'GEOMETRY_NAME={GEOMETRY_COLUMN}', f'FID={FID_COLUMN}'])
+        if self.layer is None:
+            raise OSError(f"Can't create table {self.table_name} in {self.gpkg_path}")
+        columns = table_field_names([field_name for field_name, _ in field_types], [source_field])
+        self.source_column = table_field_names([source_field])[0]
+        field_defns = [ogr.FieldDefn(column, OGR_FIELD_TYPES[field_type])
+                       for column, (_, field_type) in zip(columns, field_types)]
+        field_defns.append(ogr.FieldDefn(self.source_column, ogr.OFTString))
+        for field_defn in field_defns:
+            if self.layer.CreateField(field_defn) != ogr.OGRERR_NONE:
+                self.delete_table()
+                raise OSError(f"Can't create the field {field_defn.GetName()} of table {self.table_name}")
+
+        self.pending_rows = 0
+        self.dataset.StartTransaction()
+        return self.table_name
+
+    def add_rows(self, rows):
+        """The function inserts (x, y, attributes) rows in the current table, attributes follow its fields"""
+        write_rows(self.layer, rows)
+
+        # commit big transactions to bound the journal size
+        self.pending_rows += len(rows)
+        if self.pending_rows >= TRANSACTION_ROWS:
+            self.dataset.CommitTransaction()
+            self.dataset.StartTransaction()
+            self.pending_rows = 0
+
+    def add_file(self, path, x_field, y_field, field_types, is_canceled=None):
+        """The function streams the rows of a file in the current table, field_types being its fields.
+        It returns False if it was canceled. If the file can't be read or written to the end, the rows
+        already inserted are removed and the error (one of READ_ERRORS) is raised"""
+        try:
+            for rows in iter_attribute_chunks(path, x_field, y_field, field_types):
+                if is_canceled is not None and is_canceled():
+                    return False
+                self.add_rows(rows)
+        except READ_ERRORS:
+            self.remove_file(path)
+            raise
+        return True
+
+    def remove_file(self, path):
+        """The function deletes the rows of a file from the current table, the rows are identified by the
+        source column"""
+        quoted_path = path.replace("'", "''")
+        result = self.dataset.ExecuteSQL(
+            f'DELETE FROM "{self.table_name}" WHERE "{self.source_column}" = \'{quoted_path}\'')
+        if result is not None:
+            self.dataset.ReleaseResultSet(result)
+
+    def finish_table(self):
+        """The function commits the rows of the current table and builds its R-tree spatial index"""
+        self.dataset.CommitTransaction()
+        result = self.dataset.ExecuteSQL(f"SELECT CreateSpatialIndex('{self.table_name}', '{GEOMETRY_COLUMN}')")
+        if result is not None:
+            self.dataset.ReleaseResultSet(result)
+        self.layer = None
+
+    def discard_table(self):
+        """The function rolls back the pending rows of the current table and deletes it"""
+        self.dataset.RollbackTransaction()
+        self.delete_table()
+
+    def delete_table(self):
+        """The function deletes the current table"""
+        for index in range(self.dataset.GetLayerCount()):
+            if self.dataset.GetLayerByIndex(index).GetName() == self.table_name:
+                self.dataset.DeleteLayer(index)
+                break
+        self.layer = None
+
+    def close(self):
+        """The function flushes & closes the GeoPackage"""
+        self.layer = None
+        self.dataset = None
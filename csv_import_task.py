@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+"""
+ Background tasks opening and validating the selected CSV/TSV files.
+
+ The selected files are split in chunks, every chunk is loaded by its own
+ LayerLoadTask so the task manager runs them concurrently on all cores.
+ The files can be loaded from their columnar copies of csv_columnar.
+ In merge modes, or when writing to a GeoPackage, MergeLayerTask streams
+ groups of files into one memory layer or GeoPackage table per group.
+ A layer created in a task thread is moved to the main thread before the
+ task ends, the main thread only adds it to the project and the layer tree.
+"""
+
+import os
+from urllib.parse import quote
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCoordinateTransformContext,
+                       QgsCsException, QgsFeature, QgsField, QgsGeometry, QgsPointXY, QgsTask, QgsVectorLayer)
+
+from .csv_archive import READ_ERRORS, gdal_path
+from .csv_gpkg import GeoPackageWriter
+from .csv_preflight import extent_within, preflight
+from .csv_probe import file_dialect, probe_schema, resolve_xy_fields, validate_file
+from .csv_reader import group_sources, iter_attribute_chunks, merge_field_types
+from .csv_tree_plan import layer_name
+
+# delimitedtext provider options of the fast open mode: no type detection, no index built and
+# no file watcher, the provider has nothing to compute from the whole file when the layer is opened
+FAST_OPEN_OPTIONS = 'detectTypes=no&spatialIndex=no&subsetIndex=no&watchFile=no'
+
+# attribute of merged layers keeping the file each feature comes from
+SOURCE_FIELD = 'source_file'
+
+# provider (Qt) name of the encodings guessed by csv_probe, the Qt codecs skip the byte order marks
+PROVIDER_ENCODINGS = {
+    'utf-8': 'UTF-8', 'utf-8-sig': 'UTF-8', 'utf-16': 'UTF-16', 'utf-16-le': 'UTF-16LE', 'utf-16-be': 'UTF-16BE',
+    'utf-32': 'UTF-32', 'cp1252': 'windows-1252',
+}
+
+# delimiters the OGR CSV driver detects by itself, it has no open option for the others nor for the quote
+OGR_DELIMITERS = (',', ';', '\t')
+
+# QVariant type of the sampled field types
+FIELD_VARIANT_TYPES = {'integer': QVariant.LongLong, 'double': QVariant.Double, 'text': QVariant.String}
+
+
+def build_layer_uri(path, crs, x_field, y_field, fast_open=False, field_types=None, dialect=None):
+    """The function returns the delimitedtext provider uri of a CSV/TSV file. dialect is the sniffed delimiter,
+    quotechar & encoding of the file, the delimiter is taken from the extension if it's None. In fast open mode
+    the provider options that scan the whole file are turned off, and field_types, a list of (name, type) tuples,
+    are given to the provider instead of being detected"""
+    if dialect is None:
+        # check file type and change delimiter accordingly
+        if os.path.splitext(path)[1] == '.tsv':
+            delimiter = '\\t'
+        else:
+            delimiter = ','
+        uri = f"file:///{path}?delimiter={delimiter}&crs={crs}&xField={x_field}&yField={y_field}"
+    else:
+        delimiter = '\\t' if dialect['delimiter'] == '\t' else quote(dialect['delimiter'], safe='')
+        uri = (f"file:///{path}?delimiter={delimiter}&quote={quote(dialect['quotechar'], safe='')}"
+               f"&encoding={PROVIDER_ENCODINGS.get(dialect['encoding'], dialect['encoding'])}"
+               f"&crs={crs}&xField={x_field}&yField={y_field}")
+
+    if fast_open:
+        uri += '&' + FAST_OPEN_OPTIONS
+        for name, field_type in field_types or []:
+            uri += '&field={}:{}'.format(quote(name, safe=''), field_type)
+    return uri
+
+
+def sample_field_types(path, x_field, y_field, cache=None):
+    """The function guesses the field types of a file from its header and first rows, or takes them
+    from the schema cache. Coordinates fields are always double. It returns a list of (name, type) tuples"""
+    schema = probe_schema(path, cache)
+    if schema is None:
+        return []
+    return [(name, 'double' if name in (x_field, y_field) else field_type)
+            for name, field_type in zip(schema['header'], schema['field_types'])]
+
+
+def create_memory_layer(name, crs, field_types):
+    """The function returns an empty point memory layer with the given fields, a list of (name, type) tuples,
+    followed by the source file field"""
+    layer = QgsVectorLayer(f'Point?crs={crs}', name, 'memory')
+    layer.dataProvider().addAttributes([QgsField(field_name, FIELD_VARIANT_TYPES[field_type])
+                                        for field_name, field_type in field_types]
+                                       + [QgsField(SOURCE_FIELD, QVariant.String)])
+    layer.updateFields()
+    return layer
+
+
+def add_point_features(layer, rows):
+    """The function adds (x, y, attributes) rows as point features of a memory layer and returns their ids"""
+    fields = layer.fields()
+    features = []
+    for x, y, attributes in rows:
+        feature = QgsFeature(fields)
+        feature.setAttributes(attributes)
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+        features.append(feature)
+    _, added_features = layer.dataProvider().addFeatures(features)
+    return [feature.id() for feature in added_features]
+
+
+def create_ogr_layer(path, source, crs, x_field, y_field, cache=None):
+    """The function opens compressed data with the OGR CSV driver through its GDAL virtual file system path
+    (source), the coordinates columns are given as open options"""
+    uri = (f'CSV:{source}|option:X_POSSIBLE_NAMES={x_field}|option:Y_POSSIBLE_NAMES={y_field}'
+           '|option:AUTODETECT_TYPE=YES')
+    layer = QgsVectorLayer(uri, layer_name(path), 'ogr')
+    if not layer.isValid():
+        return None
+    layer.setCrs(QgsCoordinateReferenceSystem(crs))
+    encoding = file_dialect(path, cache)['encoding']
+    if encoding not in ('utf-8', 'utf-8-sig'):
+        layer.setProviderEncoding(PROVIDER_ENCODINGS.get(encoding, encoding))
+    return layer
+
+
+def create_stream_layer(path, crs, x_field, y_field, cache=None, is_canceled=None):
+    """The function streams a file GDAL can't read (zstd, or a dialect OGR doesn't detect) into a memory layer
+    and returns it, or None if it was canceled or can't be read"""
+    field_types = sample_field_types(path, x_field, y_field, cache)
+    layer = create_memory_layer(layer_name(path), crs, field_types)
+    try:
+        for rows in iter_attribute_chunks(path, x_field, y_field, field_types):
+            if is_canceled is not None and is_canceled():
+                return None
+            add_point_features(layer, rows)
+    except READ_ERRORS:
+        return None
+    layer.updateExtents()
+    return layer
+
+
+def create_layer(path, crs, x_field, y_field, fast_open=False, cache=None, is_canceled=None):
+    """The function converts a CSV/TSV file to a vector layer and returns it if it's valid, None otherwise.
+    Compressed files & archive members are read by decompressing them on the fly"""
+    source = gdal_path(path)
+    if source is None:
+        return create_stream_layer(path, crs, x_field, y_field, cache, is_canceled)
+    if source != path:
+        dialect = file_dialect(path, cache)
+        if dialect['delimiter'] not in OGR_DELIMITERS or dialect['quotechar'] != '"':
+            # OGR would split the rows on another delimiter, the file is read with its sniffed dialect instead
+            return create_stream_layer(path, crs, x_field, y_field, cache, is_canceled)
+        return create_ogr_layer(path, source, crs, x_field, y_field, cache)
+
+    field_types = sample_field_types(path, x_field, y_field, cache) if fast_open else None
+    uri = build_layer_uri(path, crs, x_field, y_field, fast_open, field_types, file_dialect(path, cache))
+    layer = QgsVectorLayer(uri, layer_name(path), 'delimitedtext')
+    if layer.isValid():
+        return layer
+    return None
+
+
+def crs_bounds(crs):
+    """The function returns the area of use of a CRS in its own coordinates as [xmin, ymin, xmax, ymax],
+    or None if it's unknown"""
+    crs = QgsCoordinateReferenceSystem(crs)
+    area = crs.bounds()
+    if area.isEmpty():
+        return None
+    transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem('EPSG:4326'), crs,
+                                       QgsCoordinateTransformContext())
+    try:
+        area = transform.transformBoundingBox(area)
+    except QgsCsException:
+        return None
+    return [area.xMinimum(), area.yMinimum(), area.xMaximum(), area.yMaximum()]
+
+
+def write_geopackage(gpkg_path, crs_wkt, groups, x_field, y_field, cache=None, detect_xy=False, is_canceled=None,
+                     file_done=None):
+    """The function streams every group of files (see csv_tree_plan.import_groups) in its own table of a GeoPackage and returns
+    (tables, failed): the (dir_path, table_name, layer_name) of the tables written and the paths of the files left
+    out. is_canceled is an optional callable, tables is None if it returned True. file_done is an optional callable
+    called once per file processed. It raises OSError if the GeoPackage can't be opened"""
+    writer = GeoPackageWriter(gpkg_path, crs_wkt)
+    tables = []
+    failed = []
+    try:
+        for dir_path, name, paths in groups:
+            sources, group_failed = group_sources(paths, x_field, y_field, cache, detect_xy)
+            failed.extend(group_failed)
+            if file_done is not None:
+                for _ in group_failed:
+                    file_done()
+            if not sources:
+                continue
+            field_types = merge_field_types(schema for _, _, _, schema in sources)
+            try:
+                table_name = writer.create_table(name, field_types, SOURCE_FIELD)
+            except OSError:
+                # the files of the group are left out, the other groups are written
+                failed.extend(path for path, _, _, _ in sources)
+                if file_done is not None:
+                    for _ in sources:
+                        file_done()
+                continue
+            for path, file_x_field, file_y_field, _ in sources:
+                try:
+                    if not writer.add_file(path, file_x_field, file_y_field, field_types, is_canceled):
+                        writer.discard_table()
+                        return None, failed
+                except READ_ERRORS:
+                    # its rows already written were removed
+                    failed.append(path)
+                if file_done is not None:
+                    file_done()
+            writer.finish_table()
+            tables.append((dir_path, table_name, name))
+    finally:
+        writer.close()
+    return tables, failed
+
+
+class LayerLoadTask(QgsTask):
+    """QgsTask creating the vector layers of a chunk of CSV/TSV files."""
+
+    def __init__(self, paths, crs, x_field, y_field, fast_open=False, cache=None, detect_xy=False, columnar=None,
+                 check_coordinates=False):
+        """Constructor.
+
+        :param paths: Full paths of the files loaded by this task.
+        :type paths: list
+
+        :param crs: Authority identifier of the layers CRS.
+        :type crs: str
+
+        :param x_field: Name of the X coordinate column.
+        :type x_field: str
+
+        :param y_field: Name of the Y coordinate column.
+        :type y_field: str
+
+        :param fast_open: Open the layers without letting the provider scan the files.
+        :type fast_open: bool
+
+        :param cache: Cache of the files schemas, row counts and extents.
+        :type cache: SchemaCache
+
+        :param detect_xy: Use the detected coordinates fields of the files
+            which don't have both x_field and y_field columns.
+        :type detect_xy: bool
+
+        :param columnar: Cache of columnar copies of the files, loaded instead of
+            the files when fresh. The files are loaded as text if it's None.
+        :type columnar: ColumnarCache
+
+        :param check_coordinates: Read the coordinates of the files before loading them,
+            the files without valid coordinates or outside the CRS bounds are rejected.
+        :type check_coordinates: bool
+        """
+        super().__init__('Loading {} CSV files'.format(len(paths)), QgsTask.CanCancel)
+        self.paths = paths
+        self.crs = crs
+        self.x_field = x_field
+        self.y_field = y_field
+        self.fast_open = fast_open
+        self.cache = cache
+        self.detect_xy = detect_xy
+        self.columnar = columnar
+        self.check_coordinates = check_coordinates
+        # path -> valid layer, filled by run()
+        self.layers = {}
+        # paths of the files that are not valid layers
+        self.failed = []
+        # path -> preflight of the loaded files & reason of every file that isn't loaded
+        self.stats = {}
+        self.rejected = {}
+        # number of files processed so far
+        self.done_count = 0
+
+    def run(self):
+        """The function creates the layer of every file of the chunk, it returns False if canceled"""
+        main_thread = QCoreApplication.instance().thread()
+        if self.columnar is not None:
+            crs_wkt = QgsCoordinateReferenceSystem(self.crs).toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL)
+        bounds = crs_bounds(self.crs) if self.check_coordinates else None
+
+        for path in self.paths:
+            if self.isCanceled():
+                return False
+
+            x_field, y_field = self.x_field, self.y_field
+            if self.detect_xy:
+                # use the columns of this file, from its header & first rows only
+                x_field, y_field = resolve_xy_fields(path, x_field, y_field, self.cache)
+
+            # the files which can't be loaded are skipped before any provider is created
+            if not x_field or not y_field:
+                reason = 'no coordinates columns detected'
+            else:
+                reason = validate_file(path, x_field, y_field, self.cache)
+            if reason is None and self.check_coordinates:
+                reason = self.check_file(path, x_field, y_field, bounds)
+
+            layer = None
+            if reason is None and self.columnar is not None:
+                layer = self.open_columnar(path, x_field, y_field, crs_wkt)
+                if self.isCanceled():
+                    return False
+            if reason is None and layer is None:
+                layer = create_layer(path, self.crs, x_field, y_field, self.fast_open, self.cache, self.isCanceled)
+                if layer is None:
+                    reason = 'not a valid layer'
+            if layer is not None:
+                # the layer will be used by the main thread, it must live there
+                layer.moveToThread(main_thread)
+                self.layers[path] = layer
+            else:
+                self.failed.append(path)
+                self.rejected[path] = reason
+                self.stats.pop(path, None)
+
+            self.done_count += 1
+            self.setProgress(100 * self.done_count / len(self.paths))
+
+        return True
+
+    def check_file(self, path, x_field, y_field, bounds):
+        """The function reads the coordinates of a file, keeps its preflight in stats and returns the reason
+        it's rejected for, or None if it can be loaded"""
+        stats = preflight(path, x_field, y_field, self.cache)
+        if stats is None:
+            return "can't be read"
+        if stats['extent'] is None:
+            return 'no valid coordinates'
+        if bounds is not None and not extent_within(stats['extent'], bounds):
+            return 'coordinates outside the CRS bounds'
+        self.stats[path] = stats
+        return None
+
+    def open_columnar(self, path, x_field, y_field, crs_wkt):
+        """The function returns the layer of the columnar copy of a file, the copy is made first if the file
+        changed since it was last made. It returns None if the copy can't be made or loaded"""
+        cache_path = self.columnar.lookup(path, x_field, y_field, crs_wkt)
+        if cache_path is None:
+            field_types = sample_field_types(path, x_field, y_field, self.cache)
+            try:
+                cache_path = self.columnar.convert(path, x_field, y_field, field_types, crs_wkt, SOURCE_FIELD,
+                                                   self.isCanceled)
+            except READ_ERRORS:
+                cache_path = None
+            if cache_path is None:
+                return None
+
+        layer = QgsVectorLayer(cache_path, layer_name(path), 'ogr')
+        if layer.isValid():
+            return layer
+        return None
+
+
+class MergeLayerTask(QgsTask):
+    """QgsTask streaming groups of CSV/TSV files into one layer per group, the layers are memory layers
+    or tables of a GeoPackage."""
+
+    def __init__(self, groups, crs, x_field, y_field, cache=None, detect_xy=False, gpkg_path=None):
+        """Constructor.
+
+        :param groups: List of (dir_path, layer_name, files_paths) tuples, the files of each
+            group are merged in one layer placed in the group of dir_path.
+        :type groups: list
+
+        :param crs: Authority identifier of the layers CRS.
+        :type crs: str
+
+        :param x_field: Name of the X coordinate column.
+        :type x_field: str
+
+        :param y_field: Name of the Y coordinate column.
+        :type y_field: str
+
+        :param cache: Cache of the files schemas.
+        :type cache: SchemaCache
+
+        :param detect_xy: Use the detected coordinates fields of the files
+            which don't have both x_field and y_field columns.
+        :type detect_xy: bool
+
+        :param gpkg_path: GeoPackage the groups are written to, one table each.
+            Memory layers are created if it's None.
+        :type gpkg_path: str
+        """
+        file_count = sum(len(paths) for _, _, paths in groups)
+        super().__init__('Merging {} CSV files'.format(file_count), QgsTask.CanCancel)
+        self.groups = groups
+        self.crs = crs
+        self.x_field = x_field
+        self.y_field = y_field
+        self.cache = cache
+        self.detect_xy = detect_xy
+        self.gpkg_path = gpkg_path
+        self.file_count = file_count
+        # (dir_path, merged layer) tuples, filled by run()
+        self.layers = []
+        # paths of the files that couldn't be merged
+        self.failed = []
+        # number of files processed so far
+        self.done_count = 0
+
+    def run(self):
+        """The function merges the files of every group, it returns False if canceled"""
+        if self.gpkg_path is not None:
+            return self.run_geopackage()
+
+        main_thread = QCoreApplication.instance().thread()
+        for dir_path, name, paths in self.groups:
+            layer = self.merge_files(name, paths)
+            if self.isCanceled():
+                return False
+            if layer is not None:
+                # the layer will be used by the main thread, it must live there
+                layer.moveToThread(main_thread)
+                self.layers.append((dir_path, layer))
+
+        return True
+
+    def run_geopackage(self):
+        """The function writes every group in its own table of the GeoPackage then opens the tables as layers,
+        it returns False if canceled"""
+        crs_wkt = QgsCoordinateReferenceSystem(self.crs).toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL)
+        try:
+            tables, self.failed = write_geopackage(self.gpkg_path, crs_wkt, self.groups, self.x_field, self.y_field,
+                                                   self.cache, self.detect_xy, self.isCanceled, self.file_done)
+        except OSError:
+            self.failed = [path for _, _, paths in self.groups for path in paths]
+            return False
+        if tables is None:
+            return False
+
+        main_thread = QCoreApplication.instance().thread()
+        for dir_path, table_name, name in tables:
+            layer = QgsVectorLayer(f'{self.gpkg_path}|layername={table_name}', name, 'ogr')
+            if layer.isValid():
+                # the layer will be used by the main thread, it must live there
+                layer.moveToThread(main_thread)
+                self.layers.append((dir_path, layer))
+        return True
+
+    def merge_files(self, name, paths):
+        """The function streams the given files into a new memory layer and returns it,
+        or None if none of the files has coordinates"""
+        sources, failed = group_sources(paths, self.x_field, self.y_field, self.cache, self.detect_xy)
+        self.failed.extend(failed)
+        for _ in failed:
+            self.file_done()
+        if not sources:
+            return None
+
+        field_types = merge_field_types(schema for _, _, _, schema in sources)
+        layer = create_memory_layer(name, self.crs, field_types)
+
+        for path, x_field, y_field, _ in sources:
+            feature_ids = []
+            try:
+                for rows in iter_attribute_chunks(path, x_field, y_field, field_types):
+                    if self.isCanceled():
+                        return None
+                    feature_ids.extend(add_point_features(layer, rows))
+            except READ_ERRORS:
+                # a file is merged whole or not at all
+                layer.dataProvider().deleteFeatures(feature_ids)
+                self.failed.append(path)
+            self.file_done()
+
+        layer.updateExtents()
+        return layer
+
+    def file_done(self):
+        """The function counts a processed file and updates the task progress"""
+        self.done_count += 1
+        self.setProgress(100 * self.done_count / max(1, self.file_count))
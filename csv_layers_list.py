@@ -1,17 +1,31 @@
 from PyQt5.QtWidgets import QTreeWidgetItem, QFileDialog, QAction
 from PyQt5.QtCore import Qt
-from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication
-from qgis.PyQt.QtGui import QIcon, QColor
-from qgis.PyQt.QtWidgets import QAction, QDialog
+from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, QThread
+from qgis.PyQt.QtGui import QIcon, QColor, QBrush
+from qgis.PyQt.QtWidgets import QAction, QDialog, QProgressBar, QPushButton
 from qgis.gui import QgsProjectionSelectionDialog
-from qgis.core import QgsVectorLayer, QgsProject, QgsLayerTreeGroup, QgsLayerTreeLayer, QgsCoordinateReferenceSystem
+from qgis.core import (QgsApplication, QgsProject, QgsLayerTreeGroup, QgsLayerTreeLayer, QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform, QgsCsException, QgsMessageLog, QgsRectangle, Qgis)
 
 import os.path
-import csv
-# Initialize Qt resources from file resources.py
-from .resources import *
-# Import the code for the dialog
-from .csv_layers_list_dialog import CsvLayersListDialog
+from collections import Counter
+# the modules scanning, reading and importing the files (zip, NumPy, GDAL, SQLite...) are imported where they're
+# used, loading the plugin with QGIS only costs its action
+from .csv_selection import SelectionModel
+from .csv_tree_plan import IMPORT_PER_FILE, GroupPlan, import_groups, plan_tree, top_level_dir
+
+# item data roles keeping the full path of a tree item & whether it's a directory
+PATH_ROLE = Qt.UserRole
+IS_DIR_ROLE = Qt.UserRole + 1
+
+# maximum number of files loaded by one import task
+IMPORT_CHUNK_MAX = 50
+# import targets, in the order of the import target combo box
+TARGET_DELIMITED_TEXT, TARGET_GEOPACKAGE = range(2)
+
+# background colors shared by all the items of the tree
+DIR_BRUSH = QBrush(QColor(233, 236, 239))
+FILE_BRUSH = QBrush(QColor(248, 249, 250))
 
 
 class CsvLayersList:
@@ -28,12 +42,37 @@ class CsvLayersList:
         # Save reference to the QGIS interface
         # keep full path
         self.path = ''
-        # keep part of path not in the tree
-        self.remaining_path = ''
-        # keep all csv files chosen by user
-        self.csv_lst = []
-        # Keep all folder that will be added to group tree
-        self.dir_list = []
+        # keep all csv files and folders chosen by user, with the listing of each scanned folder
+        self.selection = SelectionModel()
+        # running background scan task
+        self.scan_task = None
+        # tree items of scanned directories waiting for their own listing
+        self.scan_items = {}
+        # tree item of every directory in the tree
+        self.dir_items = {}
+        # the tree is listed one level at a time
+        self.lazy_tree = False
+        # files added by a running refresh, None for a full scan
+        self.rescan_files = None
+        # tree items of directories not listed yet in lazy mode
+        self.lazy_dirs = {}
+        # running scan of the checked directories never expanded in lazy mode, before an import
+        self.resolve_job = None
+        # running header probing tasks
+        self.probe_tasks = []
+        # column name -> number of probed files having it
+        self.column_counts = Counter()
+        # running imports, each with its files, tasks, progress bar... another import can start meanwhile
+        self.import_jobs = []
+        # watcher of the last directory imported in watch mode & its groups, layers and load settings
+        self.watcher = None
+        self.watch_state = None
+        # caches kept in the QGIS profile directory, opened by the first run(): schemas of the files already
+        # probed, listings of the scanned directories (a refresh only lists again the directories that changed)
+        # and columnar copies of the imported files, loaded instead of the files while they don't change
+        self.schema_cache = None
+        self.dir_index = None
+        self.columnar_cache = None
         # store x coordinate
         self.x_field = ''
         # store y coordinate
@@ -65,6 +104,8 @@ class CsvLayersList:
         # Check if plugin was started the first time in current QGIS session
         # Must be set in initGui() to survive plugin reloads
         self.first_start = None
+        # processing provider of the batch import algorithm
+        self.provider = None
 
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -155,10 +196,18 @@ class CsvLayersList:
 
         return action
 
+    def initProcessing(self):
+        """Register the processing provider, also called by qgis_process without the GUI."""
+        from .csv_processing import CsvBatchImportProvider
+        self.provider = CsvBatchImportProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
+        self.initProcessing()
 
-        icon_path = ':/plugins/csv_layers_list/icon.png'
+        # the icon file is used directly, the Qt resources are only registered when the plugin is started
+        icon_path = os.path.join(self.plugin_dir, 'icon.png')
         self.add_action(
             icon_path,
             text=self.tr(u'CSV Batch Import'),
@@ -175,284 +224,725 @@ class CsvLayersList:
                 self.tr(u'&CSV Batch Import'),
                 action)
             self.iface.removeToolBarIcon(action)
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+        self.stop_watch()
+        if self.schema_cache is not None:
+            self.schema_cache.close()
+            self.dir_index.close()
+
+    def new_tree_item(self, path, is_dir, check_state):
+        """The function creates a check-able item for a directory or a file, sets its check state and
+        background color, and keeps its full path and its kind in the item data."""
+        # convert directory/file name to item
+        item = QTreeWidgetItem([os.path.basename(path) or path])
+        # keep full path & kind so handlers never rebuild them from the tree or the disk
+        item.setData(0, PATH_ROLE, path)
+        item.setData(0, IS_DIR_ROLE, is_dir)
+        # make it check-able
+        item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+        # set it's state
+        item.setCheckState(0, check_state)
+        # set shared background color of directories or files
+        item.setBackground(0, DIR_BRUSH if is_dir else FILE_BRUSH)
+        return item
+
+    def add_listing(self, item, dir_path, sub_dirs, files):
+        """ the function adds the listing (sub_dirs, files) of dir_path under its tree item. It sets the check state of
+        the new items from their parent, and selects a checked directory and its files.
+        It returns the items created for the sub directories"""
+        # keep the listing of every directory to look it up without disk access
+        self.selection.register(dir_path, sub_dirs, files)
+        # new children follow the state of their parent, user may have changed it meanwhile
+        check_state = item.checkState(0)
+
+        # add dir and sub dir, then files, to their parent in csv tree at once
+        sub_dirs_items = [self.new_tree_item(directory, True, check_state) for directory in sub_dirs]
+        files_items = [self.new_tree_item(file, False, check_state) for file in files]
+        item.addChildren(sub_dirs_items + files_items)
+        self.dir_items.update(zip(sub_dirs, sub_dirs_items))
+
+        # select directory & its files if checked
+        if check_state == Qt.Checked:
+            self.selection.add_dir(dir_path)
+            self.selection.add_files(files)
+
+        return sub_dirs_items
+
+    def add_scanned_batch(self, batch, listed_only=False):
+        """ the function adds a batch of scanned directories listings to the csv_tree, each listing is a tuple
+        (dir_path, sub_dirs, files) whose directory item already exists. The listings of directories already
+        in the tree come from a refresh and are patched in place."""
+        for dir_path, sub_dirs, files in batch:
+            if self.selection.listing(dir_path) is not None:
+                self.patch_listing(dir_path, sub_dirs, files, listed_only)
+                continue
+            # get the item created for this directory when its parent was listed
+            item = self.scan_items.pop(dir_path, None)
+            if item is None:
+                # created by a refresh stopped before its listing came
+                item = self.dir_items.get(dir_path)
+            if item is None:
+                continue
+            sub_dirs_items = self.add_listing(item, dir_path, sub_dirs, files)
+            # wait for their own listing
+            self.scan_items.update(zip(sub_dirs, sub_dirs_items))
+
+    def patch_listing(self, dir_path, sub_dirs, files, listed_only=False):
+        """The function updates the children of a directory item to its new listing: items of removed entries
+        are removed with their subtree, new entries are inserted in order with the check state of the directory,
+        the other items are kept as they are. New sub directories wait for their own listing, or are left empty
+        with an expand indicator when listed_only (lazy mode)."""
+        item = self.dir_items.get(dir_path)
+        if item is None or dir_path in self.lazy_dirs:
+            # scanned before an import but not shown in the tree: never expanded in lazy mode, or beneath
+            self.selection.register(dir_path, sub_dirs, files)
+            return
+        old_dirs, old_files = self.selection.listing(dir_path)
+        new_entries = set(sub_dirs).union(files)
+
+        # remove the items of the entries that are gone
+        for index in reversed(range(item.childCount())):
+            child_item = item.child(index)
+            child_path = child_item.data(0, PATH_ROLE)
+            if child_path in new_entries:
+                continue
+            item.takeChild(index)
+            if child_item.data(0, IS_DIR_ROLE):
+                for removed_dir in self.selection.forget_subtree(child_path) + [child_path]:
+                    self.dir_items.pop(removed_dir, None)
+                    self.lazy_dirs.pop(removed_dir, None)
+                    self.scan_items.pop(removed_dir, None)
+            else:
+                self.selection.discard_file(child_path)
+
+        # insert the items of the new entries at their place, sub directories then files by name
+        check_state = item.checkState(0)
+        known_entries = set(old_dirs).union(old_files)
+        added_files = []
+        for index, (path, is_dir) in enumerate([(path, True) for path in sub_dirs] + [(path, False) for path in files]):
+            if path in known_entries:
+                continue
+            new_item = self.new_tree_item(path, is_dir, check_state)
+            item.insertChild(index, new_item)
+            if is_dir:
+                self.dir_items[path] = new_item
+                if listed_only:
+                    new_item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+                    self.lazy_dirs[path] = new_item
+                else:
+                    self.scan_items[path] = new_item
+            else:
+                added_files.append(path)
+
+        self.selection.register(dir_path, sub_dirs, files)
+        if check_state == Qt.Checked:
+            self.selection.add_files(added_files)
+        if self.rescan_files is not None:
+            self.rescan_files.extend(added_files)
+
+    def load_lazy_dir(self, item, dir_path):
+        """The function lists only the direct children of dir_path and adds them under its item,
+        the sub directories are left empty with an expand indicator until they are expanded."""
+        from .csv_scanner import list_directory
+        sub_dirs, files = list_directory(dir_path)
+        for directory, sub_dir_item in zip(sub_dirs, self.add_listing(item, dir_path, sub_dirs, files)):
+            # show the expand arrow without creating any child
+            sub_dir_item.setChildIndicatorPolicy(QTreeWidgetItem.ShowIndicator)
+            self.lazy_dirs[directory] = sub_dir_item
+        # hide the arrow of an empty directory
+        item.setChildIndicatorPolicy(QTreeWidgetItem.DontShowIndicatorWhenChildless)
+        # columns of the new files are added to the fields combo boxes
+        if files:
+            self.probe_headers(files)
+
+    def evt_itm_expanded(self, item):
+        """The function loads the children of a directory not listed yet when it's expanded (lazy mode)."""
+        full_path = item.data(0, PATH_ROLE)
+        if self.lazy_dirs.pop(full_path, None) is not None:
+            self.load_lazy_dir(item, full_path)
+
+    def resolve_lazy_dirs(self, dir_paths):
+        """The function scans the checked directories that were never expanded (lazy mode) in background tasks,
+        their listings are registered as they arrive and their files are selected. The selected files are loaded
+        once all of them are scanned. The directories stay expandable in the tree, expanding one lists it again."""
+        from .csv_scan_task import ScanTask
+        job = self.resolve_job = {'tasks': [], 'pending': len(dir_paths)}
+        for dir_path in dir_paths:
+            # the index makes walking the same directory again before the next import cheap
+            task = ScanTask(dir_path, index=self.dir_index)
+            task.batch_scanned.connect(lambda batch: self.evt_resolve_batch(job, batch))
+            task.taskCompleted.connect(lambda task=task, dir_path=dir_path: self.evt_lazy_dir_resolved(
+                job, task, dir_path))
+            task.taskTerminated.connect(lambda task=task, dir_path=dir_path: self.evt_lazy_dir_resolved(
+                job, task, dir_path))
+            job['tasks'].append(task)
+        self.dlg.run_btn.setEnabled(False)
+        self.dlg.cancel_scan_btn.setEnabled(True)
+        self.dlg.scan_status_lbl.setText(f'Scanning {len(dir_paths)} folders to load...')
+        for task in job['tasks']:
+            QgsApplication.taskManager().addTask(task)
+
+    def evt_resolve_batch(self, job, batch):
+        """The function registers the listings sent by the scan of an unexpanded directory."""
+        if job is not self.resolve_job:
+            return
+        for dir_path, sub_dirs, files in batch:
+            self.selection.register(dir_path, sub_dirs, files)
+
+    def evt_lazy_dir_resolved(self, job, task, dir_path):
+        """The function selects the files of a scanned unexpanded directory, once all of them are scanned the
+        selected files are loaded. Nothing is loaded if a scan was canceled."""
+        if job is not self.resolve_job:
+            return
+        item = self.lazy_dirs.get(dir_path)
+        if task.isCanceled():
+            job['canceled'] = True
+        elif item is not None and item.checkState(0) == Qt.Checked:
+            self.selection.select_subtree(dir_path)
+        job['pending'] -= 1
+        if job['pending']:
+            return
+
+        self.resolve_job = None
+        self.dlg.run_btn.setEnabled(True)
+        self.dlg.cancel_scan_btn.setEnabled(False)
+        if job.get('canceled'):
+            self.dlg.scan_status_lbl.setText('Scan canceled, nothing was loaded')
+            return
+        self.dlg.scan_status_lbl.clear()
+        self.load_selection()
+
+    def probe_headers(self, paths):
+        """The function starts a background task reading the headers of the given files concurrently,
+        their columns are added to the QComboBoxes when it's done."""
+        from .csv_scan_task import HeaderProbeTask
+        task = HeaderProbeTask(paths, self.schema_cache)
+        self.probe_tasks.append(task)
+        task.taskCompleted.connect(lambda: self.evt_headers_probed(task))
+        task.taskTerminated.connect(lambda: self.evt_headers_probed(task))
+        QgsApplication.taskManager().addTask(task)
+
+    def cancel_probe_headers(self):
+        """The function cancels the running header probing tasks and forgets the columns found."""
+        for task in self.probe_tasks:
+            task.cancel()
+        self.probe_tasks = []
+        self.column_counts = Counter()
+
+    def evt_headers_probed(self, task):
+        """The function adds the columns found by a header probing task to the counts of files per column
+        and refreshes the QComboBoxes."""
+        if task not in self.probe_tasks:
+            return
+        self.probe_tasks.remove(task)
+        if task.column_counts:
+            self.column_counts.update(task.column_counts)
+            self.fill_field_cmb_boxes()
+
+    def fill_field_cmb_boxes(self):
+        """The function populates the QComboBoxes with the columns of all the probed files, the columns found
+        in most files first, each with the number of files having it. The current choices are kept."""
+        for cmb_box in (self.dlg.xfield_cmbBox, self.dlg.yfield_cmbBox):
+            current_field = self.current_field(cmb_box)
+            cmb_box.clear()
+            for name, count in self.column_counts.most_common():
+                # show the file count, keep the column name as item data
+                cmb_box.addItem(f'{name} ({count} files)', name)
+            if current_field:
+                cmb_box.setCurrentIndex(max(0, cmb_box.findData(current_field)))
+
+    def current_field(self, cmb_box):
+        """The function returns the column name chosen in a fields QComboBox."""
+        return cmb_box.currentData() or cmb_box.currentText()
+
+    def evt_scan_batch(self, task, batch):
+        """The function adds a batch sent by the scan task to the tree and updates the live count."""
+        # ignore batches still queued from a canceled scan
+        if task is not self.scan_task:
+            return
+        self.add_scanned_batch(batch, task.listed_only)
+        if self.rescan_files is not None:
+            self.dlg.scan_status_lbl.setText(f'Refreshing... {task.changed_count} folders changed')
+        else:
+            self.dlg.scan_status_lbl.setText(
+                f'Scanning... {task.dir_count} folders, {task.file_count} CSV/TSV files')
+
+    def evt_scan_finished(self, task):
+        """The function ends the scan of the selected directory and fills the QComboBoxes."""
+        if task is not self.scan_task:
+            return
+        self.scan_task = None
+        self.scan_items = {}
+        self.dlg.cancel_scan_btn.setEnabled(False)
+        self.dlg.refresh_btn.setEnabled(True)
+        self.dlg.run_btn.setEnabled(True)
+
+        if self.rescan_files is not None:
+            # only the columns of the new files are missing from the combo boxes
+            status = 'Refresh canceled' if task.isCanceled() else 'Refresh finished'
+            self.dlg.scan_status_lbl.setText(
+                f'{status}: {task.changed_count} folders changed, {len(self.rescan_files)} new CSV/TSV files')
+            if self.rescan_files:
+                self.probe_headers(self.rescan_files)
+            self.rescan_files = None
+            return
 
-    def get_full_path_for_tree_item(self, item):
-        """The function constructs the full_path of given item by joining
-         the remaining_path (defined in the class) with the path_to_toplevel."""
-        parents_list = []
-        parent_item = item.parent()
-
-        while parent_item is not None:
-            # insert parent_item at index 0
-            parents_list.insert(0, parent_item)
-            parent_item = parent_item.parent()
-
-        # iterating over (prnt) in parents_list and apply the expression prnt.text(0) to it to convert to text
-        text_parents_list = [prnt.text(0) for prnt in parents_list]
-
-        # get path of item to toplevel item from text_parents_list
-        path_to_toplevel = os.path.normpath(os.path.join(os.path.sep.join(text_parents_list), item.text(0)))
-        # get full path of item
-        full_path = os.path.normpath(os.path.join(self.remaining_path, path_to_toplevel))
-
-        return full_path
-
-    def get_dirs_files(self, dir_path):
-        """The function retrieve the directories and files in the given directory
-        then breaks out of the loop after the first iteration"""
-        directories_list = []
-        files_list = []
-        # loop through the given path to get its children (directories/files)
-        for root, dirs, files in os.walk(dir_path):
-            for directory in dirs:
-                directories_list.append(os.path.normpath(os.path.join(root, directory)))
-
-            for file in files:
-                files_list.append(os.path.normpath(os.path.join(root, file)))
-
-            break
-        return directories_list, files_list
-
-    def add_subdir_and_subfiles(self, item):
-        """ the function recursively adds subdirectories and files to the tree item,and set their check state and
-        background color. It also adds the full path of the files to self.csvLst if not exist.."""
-        full_path_item = self.get_full_path_for_tree_item(item)
-        # by default add all
-        self.dir_list.append(full_path_item)
-
-        dir_list, files_list = self.get_dirs_files(full_path_item)
-
-        # recursively add dir and sub dir
-        for directory in dir_list:
-            # convert directory name to item
-            child_item = QTreeWidgetItem([os.path.basename(directory)])
-            # add it to its parent in csv tree
-            item.addChild(child_item)
-            # make it check-able
-            child_item.setFlags(child_item.flags() | Qt.ItemIsUserCheckable)
-            # set it's state ny default to checked
-            child_item.setCheckState(0, Qt.Checked)
-            # set background color
-            child_item.setBackground(0, QColor(233, 236, 239))
-
-            self.add_subdir_and_subfiles(child_item)
-
-        for file in files_list:
-            # filter csv & tsv files only
-            if file.endswith(('.csv', '.tsv')):
-                # convert file name to item
-                child_item = QTreeWidgetItem([os.path.basename(file)])
-                #  add it to its parent as a child
-                item.addChild(child_item)
-                # make it check-able
-                child_item.setFlags(child_item.flags() | Qt.ItemIsUserCheckable)
-                #  set it's state to checked
-                child_item.setCheckState(0, Qt.Checked)
-                # set background color
-                child_item.setBackground(0, QColor(248, 249, 250))
-
-                # get full path child & add it to csv list
-                child_full_path = self.get_full_path_for_tree_item(child_item)
-                # add child path to csvLst if not exist
-                if child_full_path not in self.csv_lst:
-                    self.csv_lst.append(child_full_path)
+        status = 'Scan canceled' if task.isCanceled() else 'Scan finished'
+        self.dlg.scan_status_lbl.setText(
+            f'{status}: {task.dir_count} folders, {task.file_count} CSV/TSV files')
+
+        if not self.selection.file_count():
+            # if there's no CSV/TSV files under the selected dir
+            self.iface.messageBar().pushMessage('No CSV or TSV file under this directory!', level=1)
+            return
+        else:
+            # read the headers of all the files found
+            self.probe_headers(self.selection.files)
+
+    def cancel_scan(self):
+        """The function cancels the running scan task if any, what was found so far stays in the tree.
+        A scan of unexpanded directories before an import is canceled too, the import doesn't start."""
+        if self.scan_task is not None:
+            self.scan_task.cancel()
+        if self.resolve_job is not None:
+            for task in self.resolve_job['tasks']:
+                task.cancel()
+
+    def stop_scan(self):
+        """The function cancels the running scan task if any and ignores anything it still sends."""
+        self.cancel_scan()
+        self.scan_task = None
+        self.resolve_job = None
+        self.dlg.run_btn.setEnabled(True)
+        self.scan_items = {}
+        self.rescan_files = None
+        self.dlg.cancel_scan_btn.setEnabled(False)
+        self.dlg.refresh_btn.setEnabled(bool(self.dir_items))
 
     def evt_browse_btn_clicked(self):
-        """The function allows the user to select a directory, populates the csv_tree with subdirectories and files
-        under the selected directory, and gets the column names from the first CSV file to populate the QComboBoxes."""
+        """The function allows the user to select a directory and populates the csv_tree with subdirectories and
+        files under it, either by a background task scanning the whole hierarchy or, in lazy mode, one level at
+        a time when directories are expanded."""
+        from .csv_scan_task import ScanTask
+        selected_directory = QFileDialog.getExistingDirectory(None, 'Select Directory', self.path)
+        # user closed the file dialog without choosing a directory
+        if not selected_directory:
+            return
+
+        # stop a scan & header probing still running for a previous directory
+        self.stop_scan()
+        self.cancel_probe_headers()
         self.y_field = self.dlg.yfield_cmbBox.clear()
         self.x_field = self.dlg.xfield_cmbBox.clear()
-        self.dir_list = []
-        self.csv_lst = []
-        # get full path and base name and the remaining path outside tree
-        self.path = selected_directory = os.path.normpath(QFileDialog.getExistingDirectory(None, 'Select Directory', self.path))
+        self.selection.clear()
+        self.lazy_dirs = {}
+        self.rescan_files = None
+        # keep full path of the selected directory
+        self.path = selected_directory = os.path.normpath(selected_directory)
         self.dlg.rootDirLineEdit.setText(selected_directory)
 
-        if selected_directory:
-            # clear previous Qtree
-            self.dlg.csv_tree.clear()
-
-            basename = os.path.basename(selected_directory)
-            self.remaining_path = os.path.dirname(self.path)
-
-            # convert directory name to item & add it as top level of tree
-            top_level_item = QTreeWidgetItem([basename])
-            self.dlg.csv_tree.addTopLevelItem(top_level_item)
-            # make it check-able
-            top_level_item.setFlags(top_level_item.flags() | Qt.ItemIsUserCheckable)
-            #  set it's state to checked
-            top_level_item.setCheckState(0, Qt.Checked)
-            # set background color to color of dir
-            top_level_item.setBackground(0, QColor(233, 236, 239))
-            # recursively add subdirectories and files to the selected dir
-            self.add_subdir_and_subfiles(top_level_item)
-
-            if not self.csv_lst:
-                # if there's no CSV/TSV files under the selected dir
-                self.iface.messageBar().pushMessage('No CSV or TSV file under this directory!', level=1)
-                return
-            else:
-                header_list = None
-                i = 0
-                while header_list is None and i < len(self.csv_lst):
-                    # if there's at least 1 CSV/TSV file open it, & get the columns names
-                    csv_file_path = self.csv_lst[i]
-                    with open(csv_file_path, "r", newline="") as file:
-                        reader = csv.reader(file)
-                        header_list = next(reader, None)
-                    i += 1
-
-                if header_list is not None:
-                    # Add the column names to the QComboBox
-                    self.dlg.xfield_cmbBox.addItems(header_list)
-                    self.dlg.yfield_cmbBox.addItems(header_list)
-
-    def file_is_valid(self, fpath):
-        """The function checks if file is valid as a layer or not, and also return a layer if it's valid"""
+        # clear previous Qtree
+        self.dlg.csv_tree.clear()
+
+        # convert directory to a checked item & add it as top level of tree
+        top_level_item = self.new_tree_item(selected_directory, True, Qt.Checked)
+        self.dlg.csv_tree.addTopLevelItem(top_level_item)
+        self.dir_items = {selected_directory: top_level_item}
+        self.lazy_tree = self.dlg.lazy_chkBox.isChecked()
+        self.dlg.refresh_btn.setEnabled(self.lazy_tree)
+
+        if self.lazy_tree:
+            # only the first level is listed, the rest is loaded on expand
+            self.load_lazy_dir(top_level_item, selected_directory)
+            top_level_item.setExpanded(True)
+            self.dlg.scan_status_lbl.setText('Folders are loaded when expanded')
+            return
+
+        top_level_item.setExpanded(True)
+        # scan the hierarchy in background, the tree is filled by batches as they arrive
+        self.scan_items = {selected_directory: top_level_item}
+        self.start_scan_task(ScanTask(selected_directory, index=self.dir_index))
+        self.dlg.scan_status_lbl.setText('Scanning...')
+
+    def start_scan_task(self, task):
+        """The function runs a scan task, its batches are added to the tree as they arrive. Load is disabled
+        until it ends."""
+        self.scan_task = task
+        task.batch_scanned.connect(lambda batch: self.evt_scan_batch(task, batch))
+        task.taskCompleted.connect(lambda: self.evt_scan_finished(task))
+        task.taskTerminated.connect(lambda: self.evt_scan_finished(task))
+        self.dlg.cancel_scan_btn.setEnabled(True)
+        self.dlg.refresh_btn.setEnabled(False)
+        # the fields are only known once the files found are probed, canceling the scan probes them too
+        self.dlg.run_btn.setEnabled(False)
+        QgsApplication.taskManager().addTask(task)
+
+    def evt_refresh_btn_clicked(self):
+        """The function rescans the selected directory in background, only the folders whose modification time
+        changed since they were indexed are listed again and patched in the tree, check states are kept."""
+        if not self.path or self.scan_task is not None or not self.dir_items:
+            return
+        from .csv_scan_task import ScanTask
+        self.rescan_files = []
+        # in lazy mode only the folders already listed are refreshed
+        self.start_scan_task(ScanTask(self.path, index=self.dir_index, known_dirs=self.selection.known_dirs(),
+                                      listed_only=self.lazy_tree))
+        self.dlg.scan_status_lbl.setText('Refreshing...')
+
+    def start_import(self, paths_list):
+        """The function splits the files in chunks and loads each chunk in a background task, the tasks run
+        concurrently and the layer tree is built once all of them are done. In merge modes the files are split
+        in groups merged in one layer each instead. When the target is a GeoPackage, the files or groups are
+        written in its tables by a single task, the GeoPackage having only one writer. A progress bar with a
+        cancel button is shown in the message bar meanwhile. It returns False if the user canceled the import."""
+        from .csv_import_task import LayerLoadTask, MergeLayerTask
+        gpkg_path = None
+        if self.dlg.import_target_cmbBox.currentIndex() == TARGET_GEOPACKAGE:
+            gpkg_path, _ = QFileDialog.getSaveFileName(self.dlg, 'GeoPackage to write', self.path or '',
+                                                       'GeoPackage (*.gpkg)')
+            if not gpkg_path:
+                return False
+            if not gpkg_path.lower().endswith('.gpkg'):
+                gpkg_path += '.gpkg'
+
         # get crs from combobox as str then convert to QgsCoordinateReferenceSystem obj then get .authid()
         crs = QgsCoordinateReferenceSystem(self.dlg.crs_cmbBox.currentText().split(' - ')[0]).authid()
 
-        file_name = os.path.basename(fpath)
-        name = os.path.splitext(file_name)[0]
-        extension = os.path.splitext(file_name)[1]
+        # small chunks keep all the cores busy until the end, but not too small to limit tasks overhead
+        workers = max(1, QThread.idealThreadCount())
+        chunk_size = max(1, min(IMPORT_CHUNK_MAX, -(-len(paths_list) // (workers * 4))))
+        fast_open = self.dlg.fast_open_chkBox.isChecked()
+        detect_xy = self.dlg.detect_xy_chkBox.isChecked()
+        columnar = self.columnar_cache if self.dlg.columnar_cache_chkBox.isChecked() else None
+        check_coordinates = self.dlg.check_coordinates_chkBox.isChecked()
+        mode = self.dlg.import_mode_cmbBox.currentIndex()
+        if gpkg_path is not None:
+            # one table per file or per group
+            groups = import_groups(paths_list, mode)
+            tasks = [MergeLayerTask(groups, crs, self.x_field, self.y_field, self.schema_cache, detect_xy,
+                                    gpkg_path)]
+        elif mode == IMPORT_PER_FILE:
+            load_args = (crs, self.x_field, self.y_field, fast_open, self.schema_cache, detect_xy, columnar,
+                         check_coordinates)
+            tasks = [LayerLoadTask(paths_list[i:i + chunk_size], *load_args)
+                     for i in range(0, len(paths_list), chunk_size)]
+        else:
+            # spread the groups over one task per core
+            groups = import_groups(paths_list, mode)
+            tasks = [MergeLayerTask(groups[i::workers], crs, self.x_field, self.y_field, self.schema_cache, detect_xy)
+                     for i in range(min(workers, len(groups)))]
+
+        # the merge tasks give (dir_path, layer) tuples instead of a layer per path
+        job = {'paths': paths_list, 'merged': mode != IMPORT_PER_FILE or gpkg_path is not None,
+                                 'crs': crs, 'tasks': tasks, 'pending': len(tasks)}
+        # new files are loaded with the same settings in watch mode, only layers per file are watched
+        if not job['merged'] and self.dlg.watch_chkBox.isChecked():
+            job['watch_load_args'] = load_args
+            # files listed under the imported directory are known even if they weren't selected, taken now since
+            # the selection is cleared when the dialog closes
+            job['watch_known_files'] = [path for _, _, files in self.selection.iter_subtree(top_level_dir(paths_list))
+                                        for path in files]
+
+        # progress bar & cancel button in the message bar
+        message = self.iface.messageBar().createMessage(f'Loading {len(paths_list)} CSV files...')
+        progress_bar = QProgressBar()
+        progress_bar.setRange(0, len(paths_list))
+        cancel_btn = QPushButton('Cancel')
+        cancel_btn.clicked.connect(lambda: self.cancel_import(job))
+        message.layout().addWidget(progress_bar)
+        message.layout().addWidget(cancel_btn)
+        job['progress_bar'] = progress_bar
+        job['message'] = self.iface.messageBar().pushWidget(message, level=0)
+        self.import_jobs.append(job)
+
+        for task in tasks:
+            task.progressChanged.connect(lambda _: self.update_import_progress(job))
+            task.taskCompleted.connect(lambda: self.evt_import_task_done(job))
+            task.taskTerminated.connect(lambda: self.evt_import_task_done(job))
+            QgsApplication.taskManager().addTask(task)
+        return True
+
+    def update_import_progress(self, job):
+        """The function shows the number of files processed by the tasks of the import job."""
+        if job in self.import_jobs:
+            job['progress_bar'].setValue(sum(task.done_count for task in job['tasks']))
+
+    def cancel_import(self, job):
+        """The function cancels all the tasks of a running import job, nothing of it is added to the project."""
+        if job not in self.import_jobs:
+            return
+        self.import_jobs.remove(job)
+        for task in job['tasks']:
+            task.cancel()
+        self.iface.messageBar().popWidget(job['message'])
+        self.iface.messageBar().pushMessage('CSV files loading canceled', level=1)
+
+    def evt_import_task_done(self, job):
+        """The function counts the finished tasks of the import job, once all of them are done
+        the loaded layers are added to the project and the layer tree."""
+        if job not in self.import_jobs:
+            return
+        job['pending'] -= 1
+        if job['pending']:
+            return
 
-        # check file type and change delimiter accordingly
-        if extension == '.csv':
-            delimiter = ','
-        elif extension == '.tsv':
-            delimiter = '\\t'
+        self.import_jobs.remove(job)
+        self.iface.messageBar().popWidget(job['message'])
+        # the canvas is redrawn once, after all the layers are in the project
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            self.add_import_layers(job)
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+
+    def add_import_layers(self, job):
+        """The function adds the layers of a finished import job to the project and the layer tree, reports
+        the files that couldn't be loaded and zooms on the imported data."""
+        if job['merged']:
+            # gather the merged or GeoPackage layers & the files left out of them
+            dir_layers = [dir_layer for task in job['tasks'] for dir_layer in task.layers]
+            failed = [path for task in job['tasks'] for path in task.failed]
+            self.build_tree_from_dirs(dir_layers)
+            if failed:
+                self.iface.messageBar().pushMessage(
+                    f"{len(failed)} files couldn't be imported, Please check their coordinates", level=1)
+            # the merged layers extents are already known
+            self.zoom_to_extents([[extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
+                                  for extent in (layer.extent() for _, layer in dir_layers) if not extent.isNull()],
+                                 job['crs'])
+            return
 
-        # get uri & convert file to vector layer
-        uri = f"file:///{fpath}?delimiter={delimiter}&crs={crs}&xField={self.x_field}&yField={self.y_field}"
-        layer = QgsVectorLayer(uri, name, 'delimitedtext')
+        # gather the layers & the preflight of the files of all the tasks
+        layers = {}
+        stats = {}
+        rejected = {}
+        for task in job['tasks']:
+            layers.update(task.layers)
+            stats.update(task.stats)
+            rejected.update(task.rejected)
+        top_level_path, groups = self.build_tree_from_paths(job['paths'], layers)
+        self.import_report(len(layers), stats, rejected)
+        if 'watch_load_args' in job and layers:
+            self.start_watch(top_level_path, groups, layers, job['watch_load_args'], job['watch_known_files'])
+        if stats:
+            self.zoom_to_extents([file_stats['extent'] for file_stats in stats.values()], job['crs'])
+
+    def import_report(self, loaded_count, stats, rejected):
+        """The function shows one message summing up the import: the files loaded, the rows skipped by the
+        preflight (stats) and the number of files rejected for each reason. Every rejected file is listed in
+        the log messages panel."""
+        report = f'{loaded_count} files loaded'
+        if stats:
+            row_count = sum(file_stats['row_count'] for file_stats in stats.values())
+            invalid_count = sum(file_stats['invalid_count'] for file_stats in stats.values())
+            report += f' with {row_count - invalid_count} points, {invalid_count} rows without valid coordinates'
+        if rejected:
+            reason_counts = Counter(rejected.values())
+            report += ", {} files couldn't be loaded ({})".format(
+                len(rejected), ', '.join(f'{count} {reason}' for reason, count in reason_counts.most_common()))
+            for path, reason in rejected.items():
+                QgsMessageLog.logMessage(f'{path}: {reason}', 'CSV Batch Import', Qgis.Warning)
+        self.iface.messageBar().pushMessage(report, level=1 if rejected else 0)
+
+    def zoom_to_extents(self, extents, crs):
+        """The function zooms the map canvas on the union of extents, [xmin, ymin, xmax, ymax] lists in crs."""
+        rectangle = None
+        for extent in extents:
+            if rectangle is None:
+                rectangle = QgsRectangle(*extent)
+            else:
+                rectangle.combineExtentWith(QgsRectangle(*extent))
+        if rectangle is None:
+            return
 
-        if layer.isValid():
-            # add layer to canvas without displaying it the tree
-            QgsProject.instance().addMapLayer(layer, False)
-            return True, layer
+        canvas = self.iface.mapCanvas()
+        transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem(crs), canvas.mapSettings().destinationCrs(),
+                                           QgsProject.instance())
+        try:
+            rectangle = transform.transformBoundingBox(rectangle)
+        except QgsCsException:
+            return
+        if rectangle.width() == 0 and rectangle.height() == 0:
+            # a single point
+            canvas.setCenter(rectangle.center())
         else:
-            return False, None
+            rectangle.scale(1.05)
+            canvas.setExtent(rectangle)
+        canvas.refresh()
+
+    def build_tree_from_dirs(self, dir_layers):
+        """The function populates node tree with merged layers, dir_layers is a list of (dir_path, layer) tuples,
+        it creates group nodes for the directories and adds each layer to the group of its directory"""
+        if not dir_layers:
+            return
+        # find the common path among all the directories
+        top_level_path = os.path.normpath(os.path.commonpath([dir_path for dir_path, _ in dir_layers]))
+        self.add_group_plan(plan_tree(top_level_path, sorted(dir_layers, key=lambda dir_layer: dir_layer[0])))
 
-    def build_tree_from_paths(self, paths_list):
+    def build_tree_from_paths(self, paths_list, layers):
         """The function populates node tree based on the provided paths chosen by user,
         it creates group nodes for directories and adding vector layers for CSV/TSV files,
-        based on the hierarchical structure of the paths, using the full path as a unique identifier"""
-        # handle if only one file is selected
-        if len(self.csv_lst) == 1:
-            top_level_path = os.path.normpath(os.path.dirname(self.csv_lst[0]))
-        else:
-            # find the common path among all the paths
-            top_level_path = os.path.normpath(os.path.commonpath(self.csv_lst))
-        # get base name of path
-        top_level_name = os.path.basename(top_level_path)
-        # convert it to node
-        top_level_node = QgsLayerTreeGroup(top_level_name)
-
-        # Create a dictionary to store path as key and its node as value (node_dict[path] = node)
-        node_dict = {top_level_path: top_level_node}
-
-        # loop over each path in paths_list
-        for path in paths_list:
-            # keep a copy un-altered
-            path_copy = path
-            isvalid, layer = self.file_is_valid(path)
-            # handle if coordinates doesn't match with the file
-            if not isvalid:
-                message = f"Can't load file {path}, Please check it's coordinates"
-                self.iface.messageBar().pushMessage(message, level=1)
-            # coordinates match with the file
-            else:
-                # handle if only one file is selected
-                if len(self.csv_lst) == 1:
-                    comp_lst = [os.path.basename(path_copy)]
+        based on the hierarchical structure of the paths, using the full path as a unique identifier.
+        layers holds the loaded layer of each valid path, the files that couldn't be loaded are
+        reported all at once by import_report."""
+        top_level_path = top_level_dir(paths_list)
+        plan = plan_tree(top_level_path, [(os.path.dirname(path), layers[path])
+                                          for path in paths_list if path in layers])
+        # the groups are kept to add the files found later in watch mode
+        return top_level_path, self.add_group_plan(plan)
+
+    def add_group_plan(self, plan):
+        """The function adds the layers of a GroupPlan to the project and creates its groups & layer nodes,
+        while they're detached from the project, then attaches them to the layer tree at once.
+        It returns the group node of every planned directory by path."""
+        groups = list(plan.iter_groups())
+        # register all the layers at once without displaying them in the tree
+        QgsProject.instance().addMapLayers(
+            [child for group in groups for child in group.children if not isinstance(child, GroupPlan)], False)
+
+        # store path as key and its node as value (node_dict[path] = node)
+        node_dict = {plan.path: QgsLayerTreeGroup(plan.name)}
+        # parents come before their children
+        for group in groups:
+            prnt_node = node_dict[group.path]
+            for child in group.children:
+                if isinstance(child, GroupPlan):
+                    node_dict[child.path] = QgsLayerTreeGroup(child.name)
+                    prnt_node.addChildNode(node_dict[child.path])
                 else:
-                    # Split the path into components with seperator => top level path
-                    components = path.split(top_level_path)
-                    # get the part that will be added to our tree
-                    path = components[1]
-
-                    # Split the path again into components with new sep ==> \\
-                    comp_lst = list(path.split(os.path.sep))
-                    # remove '' from list to get each directory name as item [dir1, dir2, ... file.txt]
-                    comp_lst.remove('')
-
-                # handle if only one file is selected
-                # set initial root path
-                if len(self.csv_lst) == 1:
-                    comp_path = os.path.dirname(path_copy)
+                    prnt_node.addChildNode(QgsLayerTreeLayer(child))
+        # a single insertion in the layer tree model
+        self.root_group.addChildNode(node_dict[plan.path])
+        return node_dict
+
+    def start_watch(self, root_path, groups, layers, load_args, known_files):
+        """The function watches the imported directory, the CSV/TSV files created or modified later are loaded
+        with the same settings and added to the group of their directory, known_files are the files listed under
+        the directory when the import started. It replaces the previous watch."""
+        from .csv_watch import ImportWatcher
+        self.stop_watch()
+        self.watcher = ImportWatcher(root_path, self.dir_index, known_files, layers)
+        self.watch_state = {
+            'root_path': root_path,
+            'groups': groups,
+            'layer_ids': {path: layer.id() for path, layer in layers.items()},
+            'load_args': load_args,
+        }
+        self.watcher.files_changed.connect(self.evt_watch_files_changed)
+        self.watcher.start()
+        self.iface.messageBar().pushMessage(f'Watching {root_path} for new CSV files', level=0, duration=5)
+
+    def stop_watch(self):
+        """The function stops the running watch if any."""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher.deleteLater()
+        self.watcher = None
+        self.watch_state = None
+
+    def evt_watch_files_changed(self, new_files, modified_files):
+        """The function loads the new & modified files of the watched directory in background, the watch ends
+        if its group was removed from the project."""
+        state = self.watch_state
+        if state is None:
+            return
+        top_level_node = state['groups'][state['root_path']]
+        if top_level_node.parent() is None:
+            self.stop_watch()
+            return
+        from .csv_import_task import LayerLoadTask
+        task = LayerLoadTask(new_files + modified_files, *state['load_args'])
+        task.taskCompleted.connect(lambda: self.evt_watch_files_loaded(task, state))
+        QgsApplication.taskManager().addTask(task)
+
+    def evt_watch_files_loaded(self, task, state):
+        """The function adds the layers of new files to the group of their directory and replaces the layers
+        of modified files at their place in the layer tree."""
+        if state is not self.watch_state:
+            return
+        project = QgsProject.instance()
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            project.addMapLayers(list(task.layers.values()), False)
+            old_ids = []
+            for path, layer in task.layers.items():
+                old_id = state['layer_ids'].get(path)
+                old_node = self.root_group.findLayer(old_id) if old_id else None
+                if old_node is not None:
+                    parent_node = old_node.parent()
+                    parent_node.insertChildNode(parent_node.children().index(old_node), QgsLayerTreeLayer(layer))
+                    old_ids.append(old_id)
                 else:
-                    comp_path = top_level_path
-                # set initial node as top level
-                prnt_node = top_level_node
-                # loop over components list
-                for c in comp_lst:
-                    # join top path and comp
-                    comp_path = os.path.join(comp_path, c)
-                    # check if comp path is dir and not in node_dict
-                    if os.path.isdir(comp_path) and comp_path not in node_dict:
-                        # add path as key & node as value
-                        node_dict[comp_path] = QgsLayerTreeGroup(c)
-                        # add current node to parent node
-                        prnt_node.addChildNode(node_dict[comp_path])
-                        # set child node as parent for next loop
-                        prnt_node = node_dict[comp_path]
-                    # check if comp path is in node_dict
-                    elif comp_path in node_dict:
-                        # set child node as parent for next loop
-                        prnt_node = node_dict[comp_path]
-                    # check if comp path is file (last item in comp_lst)
-                    elif os.path.isfile(comp_path):
-                        if len(self.csv_lst) == 1:
-                            prnt_dir = top_level_path
-                        else:
-                            # get parent directory path from file path
-                            prnt_dir = os.path.dirname(path_copy)
-                        # get the corresponding value to key/(parent path) from node dic
-                        prnt_node = node_dict[prnt_dir]
-                        # convert layer to node
-                        layer_node = QgsLayerTreeLayer(layer)
-                        # add layer ti its parent directory
-                        prnt_node.addChildNode(layer_node)
-        # clear node_dict & csv_lst
-        node_dict.clear()
-        self.csv_lst = []
-        self.root_group.addChildNode(top_level_node)
+                    self.watch_group(state, os.path.dirname(path)).addChildNode(QgsLayerTreeLayer(layer))
+                state['layer_ids'][path] = layer.id()
+            if old_ids:
+                project.removeMapLayers(old_ids)
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+        if task.layers:
+            self.iface.messageBar().pushMessage(
+                f'{len(task.layers)} new or updated CSV files loaded from {state["root_path"]}', level=0, duration=5)
+
+    def watch_group(self, state, dir_path):
+        """The function returns the group of a directory of the watched tree, the missing groups between the
+        closest existing one and the directory are created."""
+        groups = state['groups']
+        missing = []
+        while dir_path not in groups:
+            parent_path = os.path.dirname(dir_path)
+            if parent_path == dir_path:
+                # outside of the watched directory
+                return groups[state['root_path']]
+            missing.append(dir_path)
+            dir_path = parent_path
+        group = groups[dir_path]
+        for missing_path in reversed(missing):
+            groups[missing_path] = group = group.addGroup(os.path.basename(missing_path))
+        return group
 
     def evt_run_btn_clicked(self):
         """The function checks if valid coordinate fields and CSV files are selected.
         If so, it uses CSV file list to build the tree structure"""
         # get coordinates name in file by user
-        self.x_field = self.dlg.xfield_cmbBox.currentText()
-        self.y_field = self.dlg.yfield_cmbBox.currentText()
-
-        # if there's coordinate values & files in csvLst
-        if self.x_field and self.y_field and self.csv_lst:
-            # temp list to carry directories contain csv/tsv files
-            new_dir_list = []
-            for directory in self.dir_list:
-                # get children files for each directory in dir_list
-                files_lst = self.get_dirs_files(directory)[1]
-                # check if there is at least one file with the '.csv' or '.tsv' extension
-                if any('.csv' in file or '.tsv' in file for file in files_lst):
-                    # add directory to temp list
-                    new_dir_list.append(directory)
-
-            # set the temp list as dir_list
-            self.dir_list = new_dir_list
-            # send CSV files list (csvLst) & use it to build tree
-            self.build_tree_from_paths(self.csv_lst)
-        else:
-            #  # if there's no coordinate values or files in csvLst
-            self.iface.messageBar().pushMessage(
-                'Please make sure there\'s CSV files with valid coordinates beneath this path', level=1)
-            # clear selected directories
-            self.csv_lst = []
-            self.dir_list = []
+        self.x_field = self.current_field(self.dlg.xfield_cmbBox)
+        self.y_field = self.current_field(self.dlg.yfield_cmbBox)
+        # checked directories never expanded in lazy mode, their files aren't known yet
+        lazy_checked = [dir_path for dir_path, item in self.lazy_dirs.items() if item.checkState(0) == Qt.Checked]
+
+        # if there's no coordinate values or selected files
+        if not (self.x_field and self.y_field and (self.selection.file_count() or lazy_checked)):
+            self.warn_nothing_to_load()
+            return
+        if lazy_checked:
+            # scanned in background, the files are loaded once it's done
+            self.resolve_lazy_dirs(lazy_checked)
             return
+        self.load_selection()
 
+    def load_selection(self):
+        """The function loads the selected CSV files in background then closes the dialog, the layer tree is
+        built once they are loaded."""
+        if not self.selection.file_count():
+            self.warn_nothing_to_load()
+            return
+        if not self.start_import(self.selection.files):
+            # the GeoPackage wasn't chosen, the dialog stays as it is
+            return
         # close dialog window
         self.dlg.close()
 
+    def warn_nothing_to_load(self):
+        """The function tells the user there's nothing to load, the dialog stays open, the selection & listings
+        still match the check states of the tree."""
+        self.iface.messageBar().pushMessage(
+            'Please make sure there\'s CSV files with valid coordinates beneath this path', level=1)
+
     def evt_crs_btn_clicked(self):
         """The function allows the user to select a CRS from the QgsProjectionSelectionDialog
         and updates the combo box's current text accordingly."""
@@ -474,97 +964,88 @@ class CsvLayersList:
                 self.dlg.crs_cmbBox.setCurrentText(crs_authid + ' - ' + crs_description)
 
     def evt_itm_selected(self, item):
-        """The function manages the selection of items in the tree and updates the corresponding
-        lists (dir_list or csvLst) based on the checked or unchecked state of the items."""
+        """The function manages the selection of items in the tree and updates the selection
+        model based on the checked or unchecked state of the items."""
         # get item's full path
-        full_path = self.get_full_path_for_tree_item(item)
+        full_path = item.data(0, PATH_ROLE)
 
         # if item selected is a file
-        if os.path.isfile(full_path):
-            # if file is checked & its path doesn't exist in csvLst
-            if item.checkState(0) == Qt.Checked and full_path not in self.csv_lst:
-                # add its path to csvLst
-                self.csv_lst.append(full_path)
-
-            # if file is unchecked & its path exists in csvLst
-            elif item.checkState(0) == Qt.Unchecked and full_path in self.csv_lst:
-                # remove its path from csvLst
-                self.csv_lst.remove(full_path)
+        if not item.data(0, IS_DIR_ROLE):
+            # if file is checked add its path, if unchecked remove it
+            if item.checkState(0) == Qt.Checked:
+                self.selection.add_file(full_path)
+            elif item.checkState(0) == Qt.Unchecked:
+                self.selection.discard_file(full_path)
 
         # if item selected is a directory
-        elif os.path.isdir(full_path):
-            # if directory is unchecked & its path exist in dir_list
-            if item.checkState(0) == Qt.Unchecked and full_path in self.dir_list:
-                # remove path & its children recursively from dir_list
+        else:
+            # if directory is unchecked & it's selected
+            if item.checkState(0) == Qt.Unchecked and self.selection.has_dir(full_path):
+                # remove path & its children recursively from selection
                 self.dir_unchecked(item)
 
-            # if directory is checked & its path doesn't exist in dir_list
-            if item.checkState(0) == Qt.Checked and full_path not in self.dir_list:
-                # add path & its children recursively from dir_list
+            # if directory is checked & it isn't selected
+            if item.checkState(0) == Qt.Checked and not self.selection.has_dir(full_path):
+                # add path & its children recursively to selection
                 self.dir_checked(item)
 
+    def set_subtree_check_state(self, item, check_state):
+        """The function sets the check state of all the items beneath the given item. The model signals
+        are blocked meanwhile so the view is repainted once instead of once per item."""
+        tree = self.dlg.csv_tree
+        model = tree.model()
+        tree.setUpdatesEnabled(False)
+        model.blockSignals(True)
+        try:
+            stack = [item]
+            while stack:
+                parent_item = stack.pop()
+                for i in range(parent_item.childCount()):
+                    child_item = parent_item.child(i)
+                    child_item.setCheckState(0, check_state)
+                    stack.append(child_item)
+        finally:
+            model.blockSignals(False)
+            tree.setUpdatesEnabled(True)
+        # repaint the new check states at once
+        tree.viewport().update()
+
     def dir_checked(self, item):
-        """The function adds the checked directory and its children to the corresponding lists
-        (dir_list and csvLst) and recursively checks all child items under the directory"""
+        """The function adds the checked directory and its children to the selection
+        and checks all child items under the directory"""
         # get item's full path
-        item_path = self.get_full_path_for_tree_item(item)
-
-        # check if item path checked is dir and if not in dir_list
-        if os.path.isdir(item_path) and item_path not in self.dir_list:
-            # add directory path to dir_list
-            self.dir_list.append(item_path)
-
-        # loop on item's children recursively
-        for i in range(item.childCount()):
-            child_item = item.child(i)
-            # get full path of child
-            child_full_path = self.get_full_path_for_tree_item(child_item)
-
-            # if it's file add it to csv list
-            if os.path.isfile(child_full_path) and child_full_path not in self.csv_lst:
-                self.csv_lst.append(child_full_path)
-
-            # if it's directory call the function again
-            child_item.setCheckState(0, Qt.Checked)
-            self.dir_checked(child_item)
+        item_path = item.data(0, PATH_ROLE)
+        # select directory & all the listed directories and files beneath it
+        self.selection.select_subtree(item_path)
+        self.set_subtree_check_state(item, Qt.Checked)
 
     def dir_unchecked(self, item):
-        """The function remove the unchecked directory and its children from the corresponding lists
-        (dir_list and csvLst) and recursively checks all child items under the directory"""
+        """The function remove the unchecked directory and its children from the selection
+        and unchecks all child items under the directory"""
         # get item's full path
-        item_path = self.get_full_path_for_tree_item(item)
-
-        # check if item path unchecked is dir and if it's in dir_list
-        if os.path.isdir(item_path) and item_path in self.dir_list:
-            # remove directory path from dir_list
-            self.dir_list.remove(item_path)
-
-        # loop on item's children recursively
-        for i in range(item.childCount()):
-            child_item = item.child(i)
-            # get full path of child
-            child_full_path = self.get_full_path_for_tree_item(child_item)
-
-            # if the child is file then remove it from csv list
-            if os.path.isfile(child_full_path) and child_full_path in self.csv_lst:
-                self.csv_lst.remove(child_full_path)
-
-            # if it's directory call the function again
-            child_item.setCheckState(0, Qt.Unchecked)
-            self.dir_unchecked(child_item)
+        item_path = item.data(0, PATH_ROLE)
+        # deselect directory & all the listed directories and files beneath it
+        self.selection.deselect_subtree(item_path)
+        self.set_subtree_check_state(item, Qt.Unchecked)
 
     def on_rejected(self):
         """The function resets the state of the dialog and clears any selected values
          or lists associated with it when the user cancels the dialog."""
         # Perform actions when the dialog is rejected (Cancel button clicked)
-        # clear tree every time you run the plugin
+        # stop scanning & clear tree every time you run the plugin
+        self.stop_scan()
+        self.cancel_probe_headers()
         self.dlg.csv_tree.clear()
+        self.dlg.scan_status_lbl.clear()
         self.dlg.rootDirLineEdit.clear()
         self.y_field = self.dlg.yfield_cmbBox.clear()
         self.x_field = self.dlg.xfield_cmbBox.clear()
         self.dlg.crs_cmbBox.clear()
-        self.csv_lst = []
-        self.dir_list = []
+        self.selection.clear()
+        self.lazy_dirs = {}
+        self.dir_items = {}
+        self.rescan_files = None
+        self.dlg.refresh_btn.setEnabled(False)
         self.dlg.close()
 
     def run(self):
@@ -574,12 +1055,27 @@ class CsvLayersList:
         # Only create GUI ONCE in callback, so that it will only load when the plugin is started
         if self.first_start == True:
             self.first_start = False
+            # the Qt resources, the dialog and its .ui file are only loaded when the plugin is started, not with QGIS
+            from . import resources  # NOQA
+            from .csv_layers_list_dialog import CsvLayersListDialog
+            from .csv_columnar import ColumnarCache
+            from .csv_dir_index import DirIndex
+            from .csv_schema_cache import SchemaCache
+
+            cache_dir = os.path.join(QgsApplication.qgisSettingsDirPath(), 'csv_layers_list')
+            self.schema_cache = SchemaCache(os.path.join(cache_dir, 'schema_cache.sqlite'))
+            self.dir_index = DirIndex(os.path.join(cache_dir, 'dir_index.sqlite'))
+            self.columnar_cache = ColumnarCache(os.path.join(cache_dir, 'columnar_cache'))
 
             self.dlg = CsvLayersListDialog()
             self.dlg.browse_btn.clicked.connect(self.evt_browse_btn_clicked)
             self.dlg.crs_btn.clicked.connect(self.evt_crs_btn_clicked)
             self.dlg.csv_tree.itemClicked.connect(self.evt_itm_selected)
+            self.dlg.csv_tree.itemExpanded.connect(self.evt_itm_expanded)
             self.dlg.run_btn.clicked.connect(self.evt_run_btn_clicked)
+            self.dlg.cancel_scan_btn.clicked.connect(self.cancel_scan)
+            self.dlg.refresh_btn.clicked.connect(self.evt_refresh_btn_clicked)
+            self.dlg.cancel_scan_btn.setEnabled(False)
             self.dlg.rejected.connect(self.on_rejected)
             self.dlg.csv_tree.setHeaderLabels(['CSV Files Tree'])
             self.dlg.csv_tree.header().setDefaultAlignment(Qt.AlignCenter | Qt.AlignVCenter)
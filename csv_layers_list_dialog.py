@@ -24,12 +24,17 @@
 
 import os
 
-from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
 
-# This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
-    os.path.dirname(__file__), 'csv_layers_list_dialog_base.ui'))
+try:
+    # class compiled from the .ui file by pyuic5 (make compile / pb_tool compile), nothing to parse
+    from .csv_layers_list_dialog_base import Ui_CsvLayersListDialogBase as FORM_CLASS
+except ImportError:
+    from qgis.PyQt import uic
+
+    # This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
+    FORM_CLASS, _ = uic.loadUiType(os.path.join(
+        os.path.dirname(__file__), 'csv_layers_list_dialog_base.ui'))
 
 
 class CsvLayersListDialog(QtWidgets.QDialog, FORM_CLASS):
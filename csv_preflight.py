@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+ Preflight of the coordinates of CSV/TSV files.
+
+ Only the X/Y columns of a file are kept while it's read, they are parsed
+ in large chunks with NumPy to count the rows, the rows without valid
+ coordinates and to compute the bounding box of the file. The result is
+ kept in the schema cache, so an unchanged file is checked only once.
+ NumPy is slow to import, it's imported by the first preflight, not when
+ QGIS loads the plugin.
+"""
+
+from .csv_archive import READ_ERRORS
+from .csv_probe import file_dialect, open_reader
+
+# number of rows parsed at once
+PREFLIGHT_CHUNK_ROWS = 200000
+
+
+def _parse_float(value):
+    """The function returns the value as a float, or nan if it isn't a number"""
+    try:
+        return float(value)
+    except ValueError:
+        return float('nan')
+
+
+def parse_coordinates(values):
+    """The function converts a list of text values to a float64 array, the values which aren't
+    numbers are nan"""
+    import numpy as np
+
+    try:
+        # all the values are numbers in most chunks
+        return np.asarray(values, dtype=np.str_).astype(np.float64)
+    except ValueError:
+        return np.fromiter((_parse_float(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def preflight_file(path, x_field, y_field, dialect=None, chunk_rows=PREFLIGHT_CHUNK_ROWS):
+    """The function reads the coordinates of a file and returns a dict with its row_count, invalid_count (rows
+    whose coordinates are missing, not numbers or not finite) and extent ([xmin, ymin, xmax, ymax] of the valid
+    coordinates or None). It returns None if the file can't be read or lacks x_field or y_field.
+    The file is read with its dialect, sniffed if it's None"""
+    import numpy as np
+
+    row_count = 0
+    invalid_count = 0
+    # bounds of the valid coordinates so far
+    bounds = None
+    try:
+        with open_reader(path, dialect) as reader:
+            header = next(reader, None)
+            if not header or x_field not in header or y_field not in header:
+                return None
+            x_index = header.index(x_field)
+            y_index = header.index(y_field)
+            min_length = max(x_index, y_index) + 1
+
+            while True:
+                xs = []
+                ys = []
+                for row in reader:
+                    if len(row) < min_length:
+                        # counted as nan
+                        row = row + [''] * (min_length - len(row))
+                    xs.append(row[x_index])
+                    ys.append(row[y_index])
+                    if len(xs) >= chunk_rows:
+                        break
+                if not xs:
+                    break
+
+                x_values = parse_coordinates(xs)
+                y_values = parse_coordinates(ys)
+                valid = np.isfinite(x_values) & np.isfinite(y_values)
+                valid_count = int(np.count_nonzero(valid))
+                row_count += len(xs)
+                invalid_count += len(xs) - valid_count
+                if valid_count:
+                    x_values = x_values[valid]
+                    y_values = y_values[valid]
+                    chunk_bounds = [x_values.min(), y_values.min(), x_values.max(), y_values.max()]
+                    if bounds is None:
+                        bounds = chunk_bounds
+                    else:
+                        bounds = [min(bounds[0], chunk_bounds[0]), min(bounds[1], chunk_bounds[1]),
+                                  max(bounds[2], chunk_bounds[2]), max(bounds[3], chunk_bounds[3])]
+    except READ_ERRORS:
+        return None
+
+    return {
+        'row_count': row_count,
+        'invalid_count': invalid_count,
+        'extent': [float(value) for value in bounds] if bounds is not None else None,
+    }
+
+
+def preflight(path, x_field, y_field, cache=None):
+    """The function returns the preflight of a file for the given coordinates fields (see preflight_file), from
+    the cache (a SchemaCache) when the file didn't change since it was checked"""
+    if cache is not None:
+        cached = cache.get(path)
+        stats = cached.get('preflight') if cached is not None else None
+        if stats is not None and stats['x_field'] == x_field and stats['y_field'] == y_field:
+            return stats
+
+    stats = preflight_file(path, x_field, y_field, file_dialect(path, cache))
+    if stats is not None and cache is not None:
+        cache.update(path, preflight=dict(stats, x_field=x_field, y_field=y_field))
+    return stats
+
+
+def extent_within(extent, bounds):
+    """The function checks an extent [xmin, ymin, xmax, ymax] lies inside bounds (same layout)"""
+    return (bounds[0] <= extent[0] and bounds[1] <= extent[1]
+            and extent[2] <= bounds[2] and extent[3] <= bounds[3])
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+ Cheap probing of CSV/TSV files.
+
+ Only the header and a few rows at the start of a file are read, which is
+ enough to fill the fields combo boxes and to give the delimitedtext
+ provider explicit field types instead of letting it scan the whole file.
+ The dialect of a file (delimiter, quote & encoding) is sniffed from a
+ bounded prefix of its bytes.
+"""
+
+import codecs
+import csv
+import io
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .csv_archive import READ_ERRORS, data_name, open_binary, source_stat
+
+# number of rows read after the header to guess the field types
+SAMPLE_ROWS = 50
+
+# number of bytes read at the start of a file to sniff its dialect
+SNIFF_BYTES = 64 * 1024
+# delimiters the sniffer chooses from
+SNIFF_DELIMITERS = ',;\t|'
+# byte order marks & their encoding, the UTF-32 ones start like the UTF-16 ones and are checked first
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# number of files whose header is read at the same time, probing mostly waits for the disk or the network
+PROBE_WORKERS = 16
+# number of files handed to the threads between two cancel checks
+PROBE_CHUNK = 1000
+
+# usual names of the coordinates columns (lower case, letters & digits only) by order of preference
+X_NAMES = ('x', 'lon', 'long', 'longitude', 'lng', 'easting', 'east', 'xcoord', 'coordx', 'pointx', 'e')
+Y_NAMES = ('y', 'lat', 'latitude', 'northing', 'north', 'ycoord', 'coordy', 'pointy', 'n')
+# names meaning the coordinates are geographic, their values must be in degrees range
+GEOGRAPHIC_NAMES = ('lon', 'long', 'longitude', 'lng', 'lat', 'latitude')
+
+
+def file_delimiter(path):
+    """The function returns the delimiter of a CSV/TSV file from its extension, compressed or not"""
+    return '\t' if os.path.splitext(data_name(path))[1] == '.tsv' else ','
+
+
+def detect_encoding(prefix):
+    """The function guesses the encoding of a file from the first bytes of it: the encoding of its byte order
+    mark if any, UTF-16 if half of its bytes are zeros, UTF-8 if it decodes as such, Windows-1252 otherwise"""
+    for bom, encoding in BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    # every other byte of UTF-16 latin text is zero
+    if len(prefix) >= 4:
+        if prefix[1::2].count(0) > len(prefix) // 4:
+            return 'utf-16-le'
+        if prefix[0::2].count(0) > len(prefix) // 4:
+            return 'utf-16-be'
+    try:
+        prefix.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # the last character may be cut by the end of the prefix
+        if len(prefix) < SNIFF_BYTES or error.start < len(prefix) - 3:
+            return 'cp1252'
+    return 'utf-8'
+
+
+def sniff_dialect(path):
+    """The function returns the dialect of a file as a dict with its delimiter, quotechar and encoding, sniffed
+    from its first SNIFF_BYTES bytes. The delimiter from the extension is kept if the sniffer can't decide"""
+    dialect = {'delimiter': file_delimiter(path), 'quotechar': '"', 'encoding': 'utf-8'}
+    try:
+        with open_binary(path) as file:
+            prefix = file.read(SNIFF_BYTES)
+    except READ_ERRORS:
+        # unreadable, truncated or corrupted compressed data
+        return dialect
+    dialect['encoding'] = detect_encoding(prefix)
+
+    text = prefix.decode(dialect['encoding'], errors='replace').lstrip('\ufeff')
+    if len(prefix) == SNIFF_BYTES and '\n' in text:
+        # drop the line cut by the end of the prefix
+        text = text[:text.rindex('\n')]
+    try:
+        sniffed = csv.Sniffer().sniff(text, delimiters=SNIFF_DELIMITERS)
+    except csv.Error:
+        return dialect
+    # the header holds the delimiter unless the file has a single column
+    first_line = text.split('\n', 1)[0]
+    if sniffed.delimiter in first_line:
+        dialect['delimiter'] = sniffed.delimiter
+        dialect['quotechar'] = sniffed.quotechar or '"'
+    return dialect
+
+
+def file_dialect(path, cache=None):
+    """The function returns the dialect of a file, from its schema entry if it has one"""
+    schema = probe_schema(path, cache)
+    if schema is None:
+        return sniff_dialect(path)
+    return {key: schema[key] for key in ('delimiter', 'quotechar', 'encoding')}
+
+
+@contextmanager
+def open_reader(path, dialect=None):
+    """The function opens a file with its dialect, sniffed if it's None, and yields a csv reader of its rows.
+    Compressed files & archive members are decompressed on the fly. Undecodable bytes are replaced instead of
+    failing in the middle of a file"""
+    if dialect is None:
+        dialect = sniff_dialect(path)
+    with io.TextIOWrapper(open_binary(path), encoding=dialect['encoding'], errors='replace', newline='') as file:
+        yield csv.reader(file, delimiter=dialect['delimiter'], quotechar=dialect['quotechar'])
+
+
+def read_sample(path, dialect=None, rows=SAMPLE_ROWS):
+    """The function returns the header of the file and at most `rows` rows after it,
+    the header is None if the file is empty or can't be read"""
+    try:
+        with open_reader(path, dialect) as reader:
+            header = next(reader, None)
+            sample = [row for _, row in zip(range(rows), reader)]
+    except READ_ERRORS:
+        return None, []
+    return header, sample
+
+
+def _value_type(value):
+    """The function returns the narrowest type of a non empty value: integer, double or text"""
+    try:
+        int(value)
+        return 'integer'
+    except ValueError:
+        pass
+    try:
+        float(value)
+        return 'double'
+    except ValueError:
+        return 'text'
+
+
+def infer_field_types(header, sample):
+    """The function guesses the type (integer, double or text) of every column of the header
+    from the sampled rows, a column with no value in the sample is text"""
+    types = []
+    for index in range(len(header)):
+        column_type = None
+        for row in sample:
+            if index >= len(row) or row[index] == '':
+                continue
+            value_type = _value_type(row[index].strip())
+            # a column is as wide as its widest value
+            if value_type == 'text' or (value_type == 'double' and column_type == 'integer'):
+                column_type = value_type
+            elif column_type is None:
+                column_type = value_type
+            if column_type == 'text':
+                break
+        types.append(column_type or 'text')
+    return types
+
+
+def probe_schema(path, cache=None):
+    """The function returns the schema entry of a file: a dict with its header, dialect, field types and
+    detected X/Y fields, or None if the file has no header. The entry is taken from the cache (a SchemaCache)
+    when the file didn't change since it was probed, otherwise the file is sampled and the cache is updated"""
+    try:
+        stat = source_stat(path)
+    except OSError:
+        return None
+
+    cached = cache.get(path, stat) if cache is not None else None
+    # entries cached before the dialect was sniffed are probed again
+    if cached is not None and 'encoding' in cached:
+        return cached if cached['header'] else None
+
+    dialect = sniff_dialect(path)
+    header, sample = read_sample(path, dialect)
+    entry = dict(cached or {})
+    x_field, y_field = detect_xy_fields(header, sample) if header else (None, None)
+    entry.update(dialect)
+    entry.update({
+        'header': header,
+        'field_types': infer_field_types(header, sample) if header else [],
+        'x_field': x_field,
+        'y_field': y_field,
+    })
+    if cache is not None:
+        cache.put(path, entry, stat)
+    return entry if header else None
+
+
+def _normalize_name(name):
+    """The function returns the column name in lower case without anything but letters & digits"""
+    return re.sub('[^a-z0-9]', '', name.lower())
+
+
+def _column_values(sample, index):
+    """The function returns the numeric values of a column in the sampled rows,
+    or None if one of its non empty values isn't a number"""
+    values = []
+    for row in sample:
+        if index >= len(row) or not row[index].strip():
+            continue
+        try:
+            values.append(float(row[index]))
+        except ValueError:
+            return None
+    return values
+
+
+def _in_range(values, limit):
+    """The function checks all the values are between -limit & limit"""
+    return all(-limit <= value <= limit for value in values)
+
+
+def _find_column(names, candidates, sample, limit):
+    """The function returns the index of the first column (in candidates order) whose name is a candidate
+    and whose sampled values are numbers, in [-limit, limit] for geographic names"""
+    for candidate in candidates:
+        for index, name in enumerate(names):
+            if name != candidate:
+                continue
+            values = _column_values(sample, index)
+            if values is None:
+                continue
+            if candidate in GEOGRAPHIC_NAMES and not _in_range(values, limit):
+                continue
+            return index
+    return None
+
+
+def detect_xy_fields(header, sample):
+    """The function guesses the X & Y coordinates columns of a file from its header and sampled rows.
+    Columns are first matched by their usual names (lon/lat, x/y, easting/northing...), if none matches the
+    first pair of adjacent numeric columns in longitude/latitude ranges is taken. It returns (x_field, y_field)
+    or (None, None)"""
+    names = [_normalize_name(name) for name in header]
+    x_index = _find_column(names, X_NAMES, sample, 180)
+    y_index = _find_column(names, Y_NAMES, sample, 90)
+    if x_index is not None and y_index is not None and x_index != y_index:
+        return header[x_index], header[y_index]
+
+    # no usual names, look for adjacent non integer columns holding longitudes & latitudes
+    columns = [_column_values(sample, index) for index in range(len(header))]
+    for index in range(len(header) - 1):
+        x_values, y_values = columns[index], columns[index + 1]
+        if not x_values or not y_values:
+            continue
+        if all(value.is_integer() for value in x_values + y_values):
+            continue
+        if _in_range(x_values, 180) and _in_range(y_values, 90):
+            return header[index], header[index + 1]
+    return None, None
+
+
+def resolve_xy_fields(path, x_field, y_field, cache=None):
+    """The function returns the coordinates fields to load a file with: the chosen x_field & y_field when the
+    file has both columns, the detected ones otherwise. It returns (None, None) if the file has neither"""
+    schema = probe_schema(path, cache)
+    if schema is None:
+        return None, None
+    if x_field in schema['header'] and y_field in schema['header']:
+        return x_field, y_field
+    return schema.get('x_field'), schema.get('y_field')
+
+
+def validate_file(path, x_field, y_field, cache=None):
+    """The function checks cheaply that a file can be loaded with the given coordinates fields, from its schema
+    (cached or read from the header & first rows) and its sampled rows. It returns the reason the file can't be
+    loaded, or None if it looks valid"""
+    schema = probe_schema(path, cache)
+    if schema is None:
+        return 'no header'
+    header = schema['header']
+    if x_field not in header or y_field not in header:
+        if len(header) == 1:
+            # a single column holding other delimiters means the file isn't split as it should
+            for delimiter in ',;\t|':
+                if delimiter != schema['delimiter'] and delimiter in header[0]:
+                    return f'delimiter is {delimiter!r} instead of {schema["delimiter"]!r}'
+        return 'missing coordinates columns'
+
+    # the sampled values of numeric columns are all numbers, nothing else to check
+    field_types = dict(zip(header, schema['field_types']))
+    if field_types[x_field] != 'text' and field_types[y_field] != 'text':
+        return None
+
+    # empty or partly text columns, look for one row with both coordinates
+    x_index = header.index(x_field)
+    y_index = header.index(y_field)
+    for row in read_sample(path, schema)[1]:
+        if len(row) > max(x_index, y_index) and _is_number(row[x_index]) and _is_number(row[y_index]):
+            return None
+    return 'no valid coordinates in the first rows'
+
+
+def _is_number(value):
+    """The function checks the value is a finite number"""
+    try:
+        number = float(value)
+    except ValueError:
+        return False
+    return number - number == 0
+
+
+def probe_header(path, cache=None):
+    """The function returns the column names of a file from its schema entry (see probe_schema), the entry is
+    written to the cache so browsing the same files again doesn't read them. It returns None if there's no header"""
+    schema = probe_schema(path, cache)
+    return schema['header'] if schema is not None else None
+
+
+def count_columns(paths, cache=None, max_workers=PROBE_WORKERS, is_canceled=None):
+    """The function reads the headers of all the files concurrently and returns a Counter of the number of files
+    having each column, in the order the columns were found, and the number of files with a header.
+    is_canceled is an optional callable, probing stops as soon as it returns True"""
+    counts = Counter()
+    file_count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(paths), PROBE_CHUNK):
+            if is_canceled is not None and is_canceled():
+                break
+            chunk = paths[start:start + PROBE_CHUNK]
+            for header in executor.map(lambda path: probe_header(path, cache), chunk):
+                if not header:
+                    continue
+                file_count += 1
+                # a column repeated in one header counts once
+                counts.update(dict.fromkeys(header, 1))
+    return counts, file_count
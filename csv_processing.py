@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+ Processing provider running the batch import without the dialog.
+
+ The algorithm scans a directory, keeps the CSV/TSV files matching the
+ include/exclude patterns, validates them and streams them in a GeoPackage,
+ one table per file, per folder or for all the files. It runs in the
+ processing background thread, from the toolbox, the model builder, batch
+ mode or qgis_process, and reports its progress to QgsProcessingFeedback.
+"""
+
+import os
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import (QgsApplication, QgsCoordinateReferenceSystem, QgsProcessingAlgorithm,
+                       QgsProcessingContext, QgsProcessingException, QgsProcessingOutputMultipleLayers,
+                       QgsProcessingOutputNumber, QgsProcessingParameterBoolean, QgsProcessingParameterCrs,
+                       QgsProcessingParameterEnum, QgsProcessingParameterFile,
+                       QgsProcessingParameterFileDestination, QgsProcessingParameterString, QgsProcessingProvider)
+
+from .csv_tree_plan import IMPORT_PER_FILE, import_groups
+
+# share of the progress taken by the validation of the files, the import takes the rest
+VALIDATION_PROGRESS = 20
+
+
+def split_patterns(text):
+    """The function returns the glob patterns of a semicolon separated list"""
+    return [pattern.strip() for pattern in text.split(';') if pattern.strip()]
+
+
+class CsvBatchImportAlgorithm(QgsProcessingAlgorithm):
+    """Processing algorithm importing the CSV/TSV files of a directory in a GeoPackage."""
+
+    INPUT = 'INPUT'
+    INCLUDE = 'INCLUDE'
+    EXCLUDE = 'EXCLUDE'
+    X_FIELD = 'X_FIELD'
+    Y_FIELD = 'Y_FIELD'
+    DETECT_XY = 'DETECT_XY'
+    CRS = 'CRS'
+    MODE = 'MODE'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_LAYERS = 'OUTPUT_LAYERS'
+    IMPORTED_COUNT = 'IMPORTED_COUNT'
+    FAILED_COUNT = 'FAILED_COUNT'
+
+    def tr(self, message):
+        """The function returns the translation of message"""
+        return QCoreApplication.translate('CsvBatchImportAlgorithm', message)
+
+    def createInstance(self):
+        return CsvBatchImportAlgorithm()
+
+    def name(self):
+        return 'batchimport'
+
+    def displayName(self):
+        return self.tr('Batch import CSV files')
+
+    def shortHelpString(self):
+        return self.tr('Scans a directory for CSV/TSV files, compressed files and zip archives included, and '
+                       'imports the files having coordinates in a GeoPackage: one table per file, per folder or '
+                       'for all the files. Include and exclude are semicolon separated glob patterns matched '
+                       'against the file names and the paths relative to the directory (e.g. *.csv;2023/*). '
+                       'The files without the X/Y fields are skipped, unless the coordinates fields are detected.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(
+            self.INPUT, self.tr('Root directory'), behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterString(
+            self.INCLUDE, self.tr('Include patterns'), optional=True))
+        self.addParameter(QgsProcessingParameterString(
+            self.EXCLUDE, self.tr('Exclude patterns'), optional=True))
+        self.addParameter(QgsProcessingParameterString(self.X_FIELD, self.tr('X field'), defaultValue='x'))
+        self.addParameter(QgsProcessingParameterString(self.Y_FIELD, self.tr('Y field'), defaultValue='y'))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.DETECT_XY, self.tr('Detect the coordinates fields of the files without the X/Y fields'),
+            defaultValue=False))
+        self.addParameter(QgsProcessingParameterCrs(self.CRS, self.tr('CRS'), defaultValue='EPSG:4326'))
+        # in the order of the import modes of csv_tree_plan
+        self.addParameter(QgsProcessingParameterEnum(
+            self.MODE, self.tr('Output mode'),
+            options=[self.tr('One layer per file'), self.tr('One layer per folder'),
+                     self.tr('One layer for all the files')],
+            defaultValue=IMPORT_PER_FILE))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT, self.tr('GeoPackage'), fileFilter='GeoPackage (*.gpkg)'))
+
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUT_LAYERS, self.tr('Imported layers')))
+        self.addOutput(QgsProcessingOutputNumber(self.IMPORTED_COUNT, self.tr('Number of imported files')))
+        self.addOutput(QgsProcessingOutputNumber(self.FAILED_COUNT, self.tr('Number of skipped files')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        # the provider is registered when QGIS starts, the modules reading the files are loaded by the first run
+        from .csv_import_task import write_geopackage
+        from .csv_probe import resolve_xy_fields, validate_file
+        from .csv_scanner import filter_paths, iter_scan
+        from .csv_schema_cache import SchemaCache
+
+        root_path = os.path.normpath(self.parameterAsFile(parameters, self.INPUT, context))
+        include = split_patterns(self.parameterAsString(parameters, self.INCLUDE, context))
+        exclude = split_patterns(self.parameterAsString(parameters, self.EXCLUDE, context))
+        x_field = self.parameterAsString(parameters, self.X_FIELD, context)
+        y_field = self.parameterAsString(parameters, self.Y_FIELD, context)
+        detect_xy = self.parameterAsBoolean(parameters, self.DETECT_XY, context)
+        crs = self.parameterAsCrs(parameters, self.CRS, context)
+        mode = self.parameterAsEnum(parameters, self.MODE, context)
+        gpkg_path = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        if not os.path.isdir(root_path):
+            raise QgsProcessingException(self.tr('{} is not a directory').format(root_path))
+
+        feedback.setProgressText(self.tr('Scanning {}').format(root_path))
+        paths = [path for _, _, files in iter_scan(root_path, feedback.isCanceled) for path in files]
+        if feedback.isCanceled():
+            return {}
+        paths = filter_paths(paths, root_path, include, exclude)
+        feedback.pushInfo(self.tr('{} CSV files found').format(len(paths)))
+
+        # the schemas probed by the plugin are reused
+        cache = SchemaCache(os.path.join(QgsApplication.qgisSettingsDirPath(), 'csv_layers_list',
+                                         'schema_cache.sqlite'))
+        try:
+            feedback.setProgressText(self.tr('Validating the files'))
+            valid_paths = []
+            rejected_count = 0
+            for index, path in enumerate(paths):
+                if feedback.isCanceled():
+                    return {}
+                file_x_field, file_y_field = x_field, y_field
+                if detect_xy:
+                    file_x_field, file_y_field = resolve_xy_fields(path, x_field, y_field, cache)
+                reason = validate_file(path, file_x_field, file_y_field, cache)
+                if reason is None:
+                    valid_paths.append(path)
+                else:
+                    rejected_count += 1
+                    feedback.reportError(f'{path}: {reason}')
+                feedback.setProgress(VALIDATION_PROGRESS * (index + 1) / len(paths))
+            if not valid_paths:
+                raise QgsProcessingException(self.tr('None of the {} CSV files can be imported').format(len(paths)))
+
+            feedback.setProgressText(self.tr('Importing {} CSV files').format(len(valid_paths)))
+            done_count = 0
+
+            def file_done():
+                nonlocal done_count
+                done_count += 1
+                feedback.setProgress(VALIDATION_PROGRESS
+                                     + (100 - VALIDATION_PROGRESS) * done_count / len(valid_paths))
+
+            crs_wkt = crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED_GDAL)
+            try:
+                tables, failed = write_geopackage(gpkg_path, crs_wkt, import_groups(valid_paths, mode), x_field,
+                                                  y_field, cache, detect_xy, feedback.isCanceled, file_done)
+            except OSError as error:
+                raise QgsProcessingException(str(error))
+        finally:
+            cache.close()
+        if tables is None:
+            return {}
+        for path in failed:
+            feedback.reportError(self.tr("{}: couldn't be imported").format(path))
+
+        layers = []
+        for _, table_name, name in tables:
+            uri = f'{gpkg_path}|layername={table_name}'
+            layers.append(uri)
+            context.addLayerToLoadOnCompletion(uri, QgsProcessingContext.LayerDetails(
+                name, context.project(), self.OUTPUT_LAYERS))
+        return {
+            self.OUTPUT: gpkg_path,
+            self.OUTPUT_LAYERS: layers,
+            self.IMPORTED_COUNT: len(valid_paths) - len(failed),
+            self.FAILED_COUNT: rejected_count + len(failed),
+        }
+
+
+class CsvBatchImportProvider(QgsProcessingProvider):
+    """Processing provider of the CSV Batch Import algorithms."""
+
+    def id(self):
+        return 'csvbatchimport'
+
+    def name(self):
+        return 'CSV Batch Import'
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icon.png'))
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(CsvBatchImportAlgorithm())
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+ Streaming reader of the points of CSV/TSV files.
+
+ Files are read row by row and handed out in chunks of bounded size, so
+ converting or merging files never holds more than one chunk in memory.
+ Values are converted to the field types sampled by csv_probe on the way.
+"""
+
+from .csv_probe import open_reader, probe_schema, resolve_xy_fields
+
+# number of rows handed out at once
+CHUNK_ROWS = 10000
+
+
+def parse_number(value):
+    """The function returns the value as a float, or None if it's empty or not a number"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    # nan & inf are not coordinates
+    if number != number or number in (float('inf'), float('-inf')):
+        return None
+    return number
+
+
+def iter_point_chunks(path, x_field, y_field, dialect=None, chunk_rows=CHUNK_ROWS):
+    """The function reads a file row by row and yields tuples (header, points, invalid_count) where points is a
+    list of at most chunk_rows (x, y, row) tuples and invalid_count the number of rows skipped in the chunk
+    because their coordinates are not numbers. Nothing is yielded if the file lacks x_field or y_field.
+    The file is read with its dialect, sniffed if it's None"""
+    with open_reader(path, dialect) as reader:
+        header = next(reader, None)
+        if not header or x_field not in header or y_field not in header:
+            return
+        x_index = header.index(x_field)
+        y_index = header.index(y_field)
+        # shortest row holding both coordinates
+        min_length = max(x_index, y_index) + 1
+
+        points = []
+        invalid_count = 0
+        for row in reader:
+            if len(row) < min_length:
+                invalid_count += 1
+                continue
+            x = parse_number(row[x_index])
+            y = parse_number(row[y_index])
+            if x is None or y is None:
+                invalid_count += 1
+                continue
+            points.append((x, y, row))
+            if len(points) >= chunk_rows:
+                yield header, points, invalid_count
+                points = []
+                invalid_count = 0
+
+        if points or invalid_count:
+            yield header, points, invalid_count
+
+
+def merge_field_types(schemas):
+    """The function returns the union of the columns of the given schemas as a list of (name, type) tuples,
+    in the order they are found. A column with different types in different files is double if all of them
+    are numbers, text otherwise"""
+    merged = {}
+    for schema in schemas:
+        for name, field_type in zip(schema['header'], schema['field_types']):
+            current = merged.get(name)
+            if current is None or current == field_type:
+                merged[name] = field_type
+            elif {current, field_type} == {'integer', 'double'}:
+                merged[name] = 'double'
+            else:
+                merged[name] = 'text'
+    return list(merged.items())
+
+
+def group_sources(paths, x_field, y_field, cache=None, detect_xy=False):
+    """The function returns (sources, failed): a (path, x_field, y_field, schema) tuple for every file of a group
+    having coordinates, using its detected coordinates fields if detect_xy is set, and the paths of the others"""
+    sources = []
+    failed = []
+    for path in paths:
+        file_x_field, file_y_field = x_field, y_field
+        if detect_xy:
+            file_x_field, file_y_field = resolve_xy_fields(path, x_field, y_field, cache)
+        schema = probe_schema(path, cache)
+        if schema is None or file_x_field not in schema['header'] or file_y_field not in schema['header']:
+            failed.append(path)
+            continue
+        sources.append((path, file_x_field, file_y_field, schema))
+    return sources, failed
+
+
+def convert_value(value, field_type):
+    """The function converts a text value to the given field type, empty or unconvertible values are None"""
+    if value == '':
+        return None
+    if field_type == 'text':
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if field_type == 'integer':
+        return int(number) if number.is_integer() else None
+    return number
+
+
+def iter_attribute_chunks(path, x_field, y_field, field_types, chunk_rows=CHUNK_ROWS):
+    """The function reads a file row by row and yields lists of at most chunk_rows (x, y, attributes) tuples.
+    attributes follow field_types, a list of (name, type) tuples holding at least the columns of the file,
+    the values are converted to their field type and the file path is appended as last attribute"""
+    field_index = {name: index for index, (name, _) in enumerate(field_types)}
+    positions = None
+    for header, points, _ in iter_point_chunks(path, x_field, y_field, chunk_rows=chunk_rows):
+        if positions is None:
+            # position of each column of this file in the attributes
+            positions = [(index, field_index[name], field_types[field_index[name]][1])
+                         for index, name in enumerate(header) if name in field_index]
+        rows = []
+        for x, y, row in points:
+            attributes = [None] * (len(field_types) + 1)
+            for index, attribute_index, field_type in positions:
+                if index < len(row):
+                    attributes[attribute_index] = convert_value(row[index], field_type)
+            attributes[-1] = path
+            rows.append((x, y, attributes))
+        yield rows
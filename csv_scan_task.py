@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+ Background tasks discovering the CSV/TSV files and their columns.
+
+ The listings produced by csv_scanner.iter_scan are sent back in batches
+ through the batch_scanned signal, the signal is queued to the main thread
+ where the csv_tree is filled while the scan goes on. With a directory
+ index, a rescan only sends the directories that changed or are new. The headers of the
+ files found are then read concurrently by HeaderProbeTask.
+"""
+
+import time
+
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.core import QgsTask
+
+from .csv_probe import count_columns
+from .csv_scanner import iter_rescan, iter_scan
+
+
+class ScanTask(QgsTask):
+    """QgsTask walking a directory hierarchy and streaming what it finds."""
+
+    # list of (dir_path, sub_dirs_paths, csv_files_paths) tuples
+    batch_scanned = pyqtSignal(list)
+
+    def __init__(self, root_path, batch_size=500, batch_interval=0.2, index=None, known_dirs=None,
+                 listed_only=False):
+        """Constructor.
+
+        :param root_path: Directory to scan.
+        :type root_path: str
+
+        :param batch_size: Number of directories sent at most in one batch.
+        :type batch_size: int
+
+        :param batch_interval: Seconds after which a batch is sent even
+            if it isn't full, to keep the tree and the counters live.
+        :type batch_interval: float
+
+        :param index: Index of the directories listings, the directories which
+            didn't change are taken from it and the index is kept up to date.
+        :type index: DirIndex
+
+        :param known_dirs: Directories already in the tree, only their listings
+            that changed are sent. All the listings are sent if it's None.
+        :type known_dirs: set
+
+        :param listed_only: Walk only the known directories (lazy mode tree).
+        :type listed_only: bool
+        """
+        super().__init__('Scanning {}'.format(root_path), QgsTask.CanCancel)
+        self.root_path = root_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.index = index
+        self.known_dirs = known_dirs
+        self.listed_only = listed_only
+        # counters of what has been found so far
+        self.dir_count = 0
+        self.file_count = 0
+        # number of directories listed again because they changed
+        self.changed_count = 0
+
+    def iter_listings(self):
+        """The function yields the (dir_path, sub_dirs_paths, csv_files_paths) listings to send"""
+        if self.index is None:
+            yield from iter_scan(self.root_path, self.isCanceled)
+            return
+
+        should_visit = None
+        if self.listed_only and self.known_dirs is not None:
+            should_visit = self.known_dirs.__contains__
+        for dir_path, dirs, files, changed in iter_rescan(self.root_path, self.index, self.isCanceled,
+                                                          should_visit):
+            self.changed_count += changed
+            if changed or self.known_dirs is None or dir_path not in self.known_dirs:
+                yield dir_path, dirs, files
+
+    def run(self):
+        """The function walks root_path and emits the listings in batches, it returns False if canceled"""
+        batch = []
+        last_emit = time.monotonic()
+
+        for listing in self.iter_listings():
+            batch.append(listing)
+            self.dir_count += 1
+            self.file_count += len(listing[2])
+
+            # send the batch when it's full or when it waited long enough
+            now = time.monotonic()
+            if len(batch) >= self.batch_size or now - last_emit >= self.batch_interval:
+                self.batch_scanned.emit(batch)
+                batch = []
+                last_emit = now
+
+        if batch:
+            self.batch_scanned.emit(batch)
+
+        return not self.isCanceled()
+
+
+class HeaderProbeTask(QgsTask):
+    """QgsTask reading the headers of many files concurrently and counting the files having each column."""
+
+    def __init__(self, paths, cache=None):
+        """Constructor.
+
+        :param paths: Full paths of the files to probe.
+        :type paths: list
+
+        :param cache: Cache of the files schemas.
+        :type cache: SchemaCache
+        """
+        super().__init__('Reading headers of {} CSV files'.format(len(paths)), QgsTask.CanCancel)
+        self.paths = paths
+        self.cache = cache
+        # column name -> number of files having it, filled by run()
+        self.column_counts = None
+        # number of files with a header
+        self.file_count = 0
+
+    def run(self):
+        """The function probes the headers of all the files, it returns False if canceled"""
+        self.column_counts, self.file_count = count_columns(self.paths, self.cache, is_canceled=self.isCanceled)
+        return not self.isCanceled()
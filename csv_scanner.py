@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+ Directory scanner used to fill the CSV files tree.
+
+ The whole hierarchy under the selected root is walked once with os.scandir,
+ the file type of every entry comes from the cached DirEntry information so
+ no extra stat call is made per file, and only directories and CSV/TSV files
+ are kept in memory. Zip archives are walked like directories and gzip/zstd
+ compressed CSV/TSV files are kept as well, see csv_archive.
+"""
+
+import fnmatch
+import os
+
+from .csv_archive import data_name, is_archive_file, list_archive, source_stat, split_archive_path
+
+# extensions of the files shown in the tree
+CSV_EXTENSIONS = ('.csv', '.tsv')
+
+
+def is_csv_file(file_name):
+    """The function checks if the given file name has one of the supported extensions,
+    compressed or not"""
+    return data_name(file_name).endswith(CSV_EXTENSIONS)
+
+
+def _list_entries(dir_path, visited_links):
+    """The function lists dir_path with os.scandir and returns its sub directories and CSV/TSV files paths,
+    sorted by name, zip archives are sub directories. It raises OSError if the directory can't be listed"""
+    # a directory named like an archive is listed like any directory
+    if (is_archive_file(dir_path) and os.path.isfile(dir_path)) or split_archive_path(dir_path)[0] is not None:
+        dirs, files = list_archive(dir_path)
+        # members are read as they are, compressed members are left out
+        return dirs, [path for path in files if path.endswith(CSV_EXTENSIONS)]
+
+    dirs = []
+    files = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            try:
+                # is_dir() uses the type cached by scandir (no stat on most file systems)
+                if entry.is_dir():
+                    if entry.is_symlink():
+                        real_path = os.path.realpath(entry.path)
+                        if real_path in visited_links:
+                            continue
+                        visited_links.add(real_path)
+                    dirs.append(entry.path)
+                elif is_csv_file(entry.name):
+                    files.append(entry.path)
+                elif is_archive_file(entry.name):
+                    dirs.append(entry.path)
+            except OSError:
+                # entry vanished or can't be read, skip it
+                continue
+
+    # keep the tree in a stable alphabetical order
+    dirs.sort(key=os.path.basename)
+    files.sort(key=os.path.basename)
+    return dirs, files
+
+
+def list_directory(dir_path):
+    """The function returns the sub directories and CSV/TSV files directly under dir_path,
+    or two empty lists if it can't be listed"""
+    try:
+        return _list_entries(dir_path, set())
+    except OSError:
+        return [], []
+
+
+def iter_scan(root_path, is_canceled=None):
+    """The function walks root_path once, top-down, and yields a tuple
+    (dir_path, sub_dirs_paths, csv_files_paths) for every readable directory.
+    is_canceled is an optional callable, the walk stops as soon as it returns True"""
+    root_path = os.path.normpath(root_path)
+    # real paths of the symlinked directories already entered, to avoid loops
+    visited_links = {os.path.realpath(root_path)}
+    stack = [root_path]
+
+    while stack:
+        if is_canceled is not None and is_canceled():
+            return
+
+        dir_path = stack.pop()
+        try:
+            dirs, files = _list_entries(dir_path, visited_links)
+        except OSError:
+            # directory can't be listed (permissions, broken mount, ...)
+            continue
+
+        yield dir_path, dirs, files
+
+        # push in reverse so sub directories are visited in alphabetical order
+        stack.extend(reversed(dirs))
+
+
+def iter_rescan(root_path, index, is_canceled=None, should_visit=None, flush_size=500):
+    """The function walks root_path like iter_scan but takes the listing of a directory from the index
+    (a DirIndex) when its modification time didn't change, only the changed directories are listed again.
+    It yields (dir_path, sub_dirs_paths, csv_files_paths, changed) tuples and keeps the index up to date,
+    the listings of the removed directories are dropped. should_visit is an optional callable telling
+    if a sub directory must be walked"""
+    root_path = os.path.normpath(root_path)
+    visited_links = {os.path.realpath(root_path)}
+    stack = [root_path]
+    # listings to store & directories to drop from the index, written in batches
+    pending = []
+    removed = []
+
+    try:
+        while stack:
+            if is_canceled is not None and is_canceled():
+                return
+
+            dir_path = stack.pop()
+            try:
+                mtime = source_stat(dir_path).st_mtime_ns
+            except OSError:
+                # the directory vanished, its parent listing changed too
+                continue
+
+            indexed = index.get(dir_path)
+            if indexed is not None and indexed[0] == mtime:
+                _, dirs, files = indexed
+                changed = False
+            else:
+                try:
+                    dirs, files = _list_entries(dir_path, visited_links)
+                except OSError:
+                    continue
+                changed = True
+                pending.append((dir_path, mtime, dirs, files))
+                if indexed is not None:
+                    removed.extend(set(indexed[1]).difference(dirs))
+                if len(pending) >= flush_size:
+                    index.put_many(pending)
+                    pending = []
+
+            yield dir_path, dirs, files, changed
+
+            stack.extend(directory for directory in reversed(dirs)
+                         if should_visit is None or should_visit(directory))
+    finally:
+        if removed:
+            index.delete_subtrees(removed)
+        if pending:
+            index.put_many(pending)
+
+
+def file_signature(path):
+    """The function returns the (size, mtime) of the data of a file, or None if it's gone"""
+    try:
+        stat = source_stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def find_changes(root_path, index, known_files, signatures, is_canceled=None):
+    """The function walks root_path with the directory index and returns (dirs, new_files, modified_files):
+    all the directories found, the files which aren't in known_files and the files of signatures, a dict
+    path -> (size, mtime) updated in place, whose signature changed. A None signature is only recorded.
+    The signatures of the new files are recorded too, a file still being written when it's found is modified
+    afterwards"""
+    dirs = []
+    found_files = []
+    for dir_path, _, files, _ in iter_rescan(root_path, index, is_canceled):
+        dirs.append(dir_path)
+        found_files.extend(path for path in files if path not in known_files)
+
+    modified_files = []
+    for path, signature in signatures.items():
+        if is_canceled is not None and is_canceled():
+            break
+        current = file_signature(path)
+        if current is not None and current != signature:
+            if signature is not None:
+                modified_files.append(path)
+            signatures[path] = current
+
+    new_files = []
+    for path in found_files:
+        signature = file_signature(path)
+        # gone since the directory was listed
+        if signature is not None:
+            signatures[path] = signature
+            new_files.append(path)
+    return dirs, new_files, modified_files
+
+
+def _matches(name, relative_path, patterns):
+    """The function checks if a file name or relative path matches one of the glob patterns"""
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+
+def filter_paths(paths, root_path, include=(), exclude=()):
+    """The function returns the paths matching one of the include glob patterns, all of them if there's none,
+    and none of the exclude patterns. A pattern is matched against the file name and the path relative to
+    root_path with / separators (sub/*.csv, */2023/*)"""
+    kept = []
+    for path in paths:
+        name = os.path.basename(path)
+        relative_path = os.path.relpath(path, root_path).replace(os.sep, '/')
+        if include and not _matches(name, relative_path, include):
+            continue
+        if exclude and _matches(name, relative_path, exclude):
+            continue
+        kept.append(path)
+    return kept
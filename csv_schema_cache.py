@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+ Persistent cache of what is known about each CSV/TSV file.
+
+ Entries are stored in a SQLite database and keyed by the file path, they
+ are only valid while the file size and modification time are unchanged,
+ so browsing or importing the same files again doesn't read them again.
+ An entry is a dict which may hold the header, delimiter, encoding, field
+ types, detected X/Y fields and coordinates preflight of the file. Archive
+ members are keyed by their virtual path and valid while their archive is
+ unchanged.
+"""
+
+import json
+
+from .csv_archive import source_stat
+from .csv_sqlite import SqliteStore
+
+
+class SchemaCache(SqliteStore):
+    """SQLite backed cache of files schemas keyed by (path, size, mtime)."""
+
+    CREATE_TABLE = ('CREATE TABLE IF NOT EXISTS schema ('
+                    'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, data TEXT NOT NULL)')
+
+    def get(self, path, stat=None):
+        """The function returns the cached entry of path, or None if there's none or if the file changed
+        since it was cached. stat is the os.stat_result of the file if it's already known"""
+        try:
+            stat = stat or source_stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT size, mtime, data FROM schema WHERE path = ?', (path,)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return json.loads(row[2])
+
+    def put(self, path, entry, stat=None):
+        """The function stores the entry of path for its current size and modification time"""
+        try:
+            stat = stat or source_stat(path)
+        except OSError:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO schema (path, size, mtime, data) VALUES (?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime_ns, json.dumps(entry)))
+            conn.commit()
+
+    def update(self, path, **values):
+        """The function adds values to the cached entry of path, a new entry is created if needed"""
+        try:
+            stat = source_stat(path)
+        except OSError:
+            return
+        entry = self.get(path, stat) or {}
+        entry.update(values)
+        self.put(path, entry, stat)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+ Selection state of the CSV files tree.
+
+ Selected directories and files are kept in dicts used as insertion ordered
+ sets, so membership, add and remove are O(1) and files keep the order in
+ which they were listed. The listing of every scanned directory is indexed
+ by its path, which lets a whole subtree be selected or deselected in time
+ proportional to its size, without touching the tree widget or the disk.
+"""
+
+
+class SelectionModel:
+    """Directories and CSV/TSV files chosen by the user, indexed by full path."""
+
+    def __init__(self):
+        # selected directories and files, values are unused (ordered sets)
+        self._dirs = {}
+        self._files = {}
+        # listing of every known directory: path -> (sub_dirs_paths, files_paths)
+        self._listings = {}
+
+    def clear(self):
+        """The function forgets every listing and selected path"""
+        self._dirs.clear()
+        self._files.clear()
+        self._listings.clear()
+
+    def register(self, dir_path, sub_dirs, files):
+        """The function records the listing of dir_path, it's used by subtree operations"""
+        self._listings[dir_path] = (sub_dirs, files)
+
+    def listing(self, dir_path):
+        """The function returns the recorded (sub_dirs, files) of dir_path or None if it wasn't listed"""
+        return self._listings.get(dir_path)
+
+    @property
+    def files(self):
+        """List of the selected files in listing order"""
+        return list(self._files)
+
+    @property
+    def dirs(self):
+        """List of the selected directories in listing order"""
+        return list(self._dirs)
+
+    def file_count(self):
+        """The function returns the number of selected files"""
+        return len(self._files)
+
+    def has_file(self, file_path):
+        """The function checks if file_path is selected"""
+        return file_path in self._files
+
+    def has_dir(self, dir_path):
+        """The function checks if dir_path is selected"""
+        return dir_path in self._dirs
+
+    def add_file(self, file_path):
+        """The function selects file_path, nothing changes if it's already selected"""
+        self._files[file_path] = None
+
+    def discard_file(self, file_path):
+        """The function deselects file_path if it's selected"""
+        self._files.pop(file_path, None)
+
+    def add_files(self, files_paths):
+        """The function selects all the given files"""
+        self._files.update(dict.fromkeys(files_paths))
+
+    def add_dir(self, dir_path):
+        """The function selects dir_path, nothing changes if it's already selected"""
+        self._dirs[dir_path] = None
+
+    def discard_dir(self, dir_path):
+        """The function deselects dir_path if it's selected"""
+        self._dirs.pop(dir_path, None)
+
+    def iter_subtree(self, dir_path):
+        """The function yields (dir_path, sub_dirs, files) for dir_path and every listed directory beneath it"""
+        stack = [dir_path]
+        while stack:
+            path = stack.pop()
+            listing = self._listings.get(path)
+            if listing is None:
+                # directory not listed yet (lazy mode or scan still running)
+                continue
+            sub_dirs, files = listing
+            yield path, sub_dirs, files
+            stack.extend(sub_dirs)
+
+    def select_subtree(self, dir_path):
+        """The function selects dir_path and every listed directory and file beneath it"""
+        self.add_dir(dir_path)
+        for path, _, files in self.iter_subtree(dir_path):
+            self._dirs[path] = None
+            self.add_files(files)
+
+    def deselect_subtree(self, dir_path):
+        """The function deselects dir_path and every listed directory and file beneath it"""
+        self.discard_dir(dir_path)
+        for path, _, files in self.iter_subtree(dir_path):
+            self._dirs.pop(path, None)
+            for file_path in files:
+                self._files.pop(file_path, None)
+
+    def known_dirs(self):
+        """The function returns the set of the listed directories"""
+        return set(self._listings)
+
+    def forget_subtree(self, dir_path):
+        """The function deselects dir_path and everything beneath it and drops their listings,
+        it returns the paths of the directories dropped"""
+        self.deselect_subtree(dir_path)
+        dirs = [path for path, _, _ in self.iter_subtree(dir_path)]
+        for path in dirs:
+            del self._listings[path]
+        return dirs
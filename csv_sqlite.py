@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+ SQLite databases kept in the QGIS profile directory.
+
+ The schema cache and the directory index share one connection per
+ database, opened on first use in WAL mode and used by the background
+ tasks threads under a lock, see csv_schema_cache and csv_dir_index.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class SqliteStore:
+    """SQLite database opened on first use, subclasses set the CREATE TABLE statement of their table."""
+
+    # statement creating the table of the store if it's missing
+    CREATE_TABLE = None
+
+    def __init__(self, db_path):
+        """Constructor.
+
+        :param db_path: Path of the SQLite database, created if missing.
+        :type db_path: str
+        """
+        self.db_path = db_path
+        # the connection is shared by the background tasks threads, every use holds the lock
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        """The function opens the database on first use and returns the connection"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(self.CREATE_TABLE)
+        return self._conn
+
+    def close(self):
+        """The function closes the database connection"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+ Planning of the layers of an import and of their layer tree groups.
+
+ The files are grouped in layers and the groups of the layer tree are
+ planned from the paths only, nothing is read from the file system (zip
+ archives are directories too). Like the scanner, the probing and the
+ selection model, this module doesn't depend on Qt or QGIS: the plugin
+ turns a GroupPlan into QgsLayerTreeGroup nodes.
+"""
+
+import os
+
+# import modes, in the order of the import mode combo box
+IMPORT_PER_FILE, IMPORT_MERGE_PER_FOLDER, IMPORT_MERGE_ALL = range(3)
+
+
+def layer_name(path):
+    """The function returns the name of the layer of a CSV/TSV file (file name without extensions)"""
+    # csv_archive loads zipfile & zstandard, the processing provider and the plugin import this module with QGIS
+    from .csv_archive import data_name
+    return os.path.splitext(data_name(path))[0]
+
+
+def import_groups(paths_list, mode):
+    """The function returns the groups of files imported in one layer each, as (dir_path, layer_name, paths)
+    tuples: one group per file, one group per directory when merging per folder, one group of all the files
+    otherwise"""
+    if mode == IMPORT_PER_FILE:
+        return [(os.path.dirname(path), layer_name(path), [path]) for path in paths_list]
+    if mode == IMPORT_MERGE_PER_FOLDER:
+        dir_files = {}
+        for path in paths_list:
+            dir_files.setdefault(os.path.dirname(path), []).append(path)
+        return [(dir_path, os.path.basename(dir_path), paths) for dir_path, paths in dir_files.items()]
+
+    top_level_path = os.path.commonpath([os.path.dirname(path) for path in paths_list])
+    return [(top_level_path, os.path.basename(top_level_path), paths_list)]
+
+
+def top_level_dir(paths_list):
+    """The function returns the directory holding all the given files, the directory of the file if there's one"""
+    if len(paths_list) == 1:
+        return os.path.normpath(os.path.dirname(paths_list[0]))
+    return os.path.normpath(os.path.commonpath(paths_list))
+
+
+class GroupPlan:
+    """A planned group of the layer tree with its sub groups & items, in the order they were added."""
+
+    __slots__ = ('path', 'name', 'children', '_groups')
+
+    def __init__(self, path):
+        # full path of the directory of the group
+        self.path = path
+        # name displayed in the layer tree
+        self.name = os.path.basename(path) or path
+        # sub groups (GroupPlan) and items (layers), in the order they were added
+        self.children = []
+        # sub group of each sub directory name
+        self._groups = {}
+
+    def group(self, name):
+        """The function returns the sub group of a directory name, it's added if missing"""
+        group = self._groups.get(name)
+        if group is None:
+            group = self._groups[name] = GroupPlan(os.path.join(self.path, name))
+            self.children.append(group)
+        return group
+
+    def iter_groups(self):
+        """The function yields this group and all the groups beneath it, parents before children"""
+        stack = [self]
+        while stack:
+            group = stack.pop()
+            yield group
+            stack.extend(reversed([child for child in group.children if isinstance(child, GroupPlan)]))
+
+
+def plan_tree(top_level_path, entries):
+    """The function returns the GroupPlan of top_level_path holding entries, (dir_path, item) tuples: every item
+    is added to the group of its directory, the groups between top_level_path and the directory are planned"""
+    top_level_group = GroupPlan(top_level_path)
+    for dir_path, item in entries:
+        group = top_level_group
+        relative_path = os.path.relpath(dir_path, top_level_path)
+        if relative_path != os.curdir:
+            for name in relative_path.split(os.path.sep):
+                group = group.group(name)
+        group.children.append(item)
+    return top_level_group
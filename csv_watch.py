@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+ Watch of an imported directory for new or modified CSV/TSV files.
+
+ QFileSystemWatcher reports the changes of the watched directories, the
+ events are debounced so a burst of uploads is checked once. Network mounts
+ don't always report changes, the directory is polled as well. A check
+ walks the directory with the directory index, so only the changed folders
+ are listed, and compares the imported files stats with the ones they had
+ when they were loaded (see csv_scanner.find_changes). The changes are sent in
+ one batch by files_changed.
+"""
+
+from qgis.PyQt.QtCore import QFileSystemWatcher, QObject, QTimer, pyqtSignal
+from qgis.core import QgsApplication, QgsTask
+
+from .csv_scanner import find_changes
+
+# milliseconds without event before a check starts
+DEBOUNCE_INTERVAL = 2000
+# milliseconds between two checks when nothing is reported
+POLL_INTERVAL = 30000
+# maximum number of directories watched, the others are only polled
+WATCHED_DIRS_MAX = 2000
+
+
+class WatchCheckTask(QgsTask):
+    """QgsTask looking for the new & modified files of a watched directory."""
+
+    def __init__(self, root_path, index, known_files, signatures):
+        """Constructor.
+
+        :param root_path: Watched directory.
+        :type root_path: str
+
+        :param index: Index of the directories listings.
+        :type index: DirIndex
+
+        :param known_files: Files already found under the directory.
+        :type known_files: set
+
+        :param signatures: (size, mtime) of every imported file, updated by the task.
+            It must be a copy the main thread doesn't change meanwhile.
+        :type signatures: dict
+        """
+        super().__init__('Checking {}'.format(root_path), QgsTask.CanCancel)
+        self.root_path = root_path
+        self.index = index
+        self.known_files = known_files
+        self.signatures = signatures
+        # filled by run()
+        self.dirs = []
+        self.new_files = []
+        self.modified_files = []
+
+    def run(self):
+        """The function looks for the changes, it returns False if canceled"""
+        self.dirs, self.new_files, self.modified_files = find_changes(
+            self.root_path, self.index, self.known_files, self.signatures, self.isCanceled)
+        return not self.isCanceled()
+
+
+class ImportWatcher(QObject):
+    """Watcher of an imported directory sending the new & modified CSV/TSV files in batches."""
+
+    # new files paths, modified files paths
+    files_changed = pyqtSignal(list, list)
+
+    def __init__(self, root_path, index, known_files, imported_files, parent=None):
+        """Constructor.
+
+        :param root_path: Imported directory to watch.
+        :type root_path: str
+
+        :param index: Index of the directories listings.
+        :type index: DirIndex
+
+        :param known_files: Files found under the directory when it was imported,
+            imported or not. Only the files created afterwards are new.
+        :type known_files: iterable
+
+        :param imported_files: Imported files watched for modifications.
+        :type imported_files: iterable
+        """
+        super().__init__(parent)
+        self.root_path = root_path
+        self.index = index
+        self.known_files = set(known_files)
+        # the signatures are recorded by the first check
+        self.signatures = dict.fromkeys(imported_files)
+        self.check_task = None
+        # a change was reported while a check was running
+        self.dirty = False
+        # the first check only records what's there, folders never listed in lazy mode included
+        self.baseline = True
+
+        self.fs_watcher = QFileSystemWatcher(self)
+        self.fs_watcher.directoryChanged.connect(self.schedule_check)
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(DEBOUNCE_INTERVAL)
+        self.debounce_timer.timeout.connect(self.check)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(POLL_INTERVAL)
+        self.poll_timer.timeout.connect(self.check)
+
+    def start(self):
+        """The function starts watching, the first check records the state of the directory"""
+        self.poll_timer.start()
+        self.check()
+
+    def stop(self):
+        """The function stops watching, nothing is sent afterwards"""
+        self.poll_timer.stop()
+        self.debounce_timer.stop()
+        if self.fs_watcher.directories():
+            self.fs_watcher.removePaths(self.fs_watcher.directories())
+        if self.check_task is not None:
+            self.check_task.cancel()
+            self.check_task = None
+
+    def schedule_check(self, _=None):
+        """The function (re)starts the debounce timer, the check runs once the events stop"""
+        self.debounce_timer.start()
+
+    def check(self):
+        """The function starts a background check of the directory unless one is running"""
+        if self.check_task is not None:
+            self.dirty = True
+            return
+        self.dirty = False
+        # the task works on copies, files can be added meanwhile
+        task = self.check_task = WatchCheckTask(self.root_path, self.index, set(self.known_files),
+                                                dict(self.signatures))
+        task.taskCompleted.connect(lambda: self.evt_check_done(task))
+        task.taskTerminated.connect(lambda: self.evt_check_done(task))
+        QgsApplication.taskManager().addTask(task)
+
+    def evt_check_done(self, task):
+        """The function watches the directories found and sends the changes found by a check"""
+        if task is not self.check_task:
+            return
+        self.check_task = None
+
+        # watch the new directories, as many as the system allows
+        watched = set(self.fs_watcher.directories())
+        room = WATCHED_DIRS_MAX - len(watched)
+        new_dirs = [dir_path for dir_path in task.dirs if dir_path not in watched][:max(0, room)]
+        if new_dirs:
+            self.fs_watcher.addPaths(new_dirs)
+
+        # new files are watched from now on, a file that fails to load (e.g. still being uploaded) is sent
+        # again as modified once it changes
+        self.known_files.update(task.new_files)
+        if self.baseline:
+            # the files found by the first check weren't imported, they aren't watched
+            for path in task.new_files:
+                task.signatures.pop(path, None)
+        self.signatures.update(task.signatures)
+        if self.baseline:
+            self.baseline = False
+        elif task.new_files or task.modified_files:
+            self.files_changed.emit(task.new_files, task.modified_files)
+        if self.dirty:
+            self.schedule_check()
@@ -170,6 +170,28 @@ class QgisInterface(QObject):
         """
         pass
 
+    def addPluginToVectorMenu(self, name, action):
+        """Add an action to a plugin sub menu of the vector menu.
+
+        :param name: Name of the plugin sub menu.
+        :type name: str
+
+        :param action: Action to add to the menu.
+        :type action: QAction
+        """
+        pass
+
+    def removePluginVectorMenu(self, name, action):
+        """Remove an action from a plugin sub menu of the vector menu.
+
+        :param name: Name of the plugin sub menu.
+        :type name: str
+
+        :param action: Action to remove from the menu.
+        :type action: QAction
+        """
+        pass
+
     def addToolBar(self, name):
         """Add toolbar with specified name.
 
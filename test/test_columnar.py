@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Tests of the columnar cache of the imported files, they need GDAL.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@alfajer'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2023, alfajer'
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from osgeo import osr
+    from ..csv_columnar import ColumnarCache
+except ImportError:
+    # GDAL isn't available
+    osr = None
+
+FIELD_TYPES = [('name', 'text'), ('x', 'double'), ('y', 'double')]
+
+
+@unittest.skipIf(osr is None, 'GDAL is not available')
+class ColumnarCacheTest(unittest.TestCase):
+    """Test the cache files are only used while their source is unchanged and the stale ones are removed."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.root = tempfile.mkdtemp()
+        self.cache = ColumnarCache(os.path.join(self.root, 'cache'))
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        self.crs_wkt = srs.ExportToWkt()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        """Write a file under the test directory and return its path."""
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def cache_files(self):
+        """Return the names of the files in the cache directory."""
+        return sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.cache.cache_dir, '*')))
+
+    def test_cache_path_staleness(self):
+        """The cache file of a file changes with its content, its coordinates fields and its CRS."""
+        path = self.write('points.csv', 'name,x,y\na,1,2\n')
+        cache_path = self.cache.cache_path(path, 'x', 'y', self.crs_wkt)
+        self.assertEqual(self.cache.cache_path(path, 'x', 'y', self.crs_wkt), cache_path)
+        self.assertNotEqual(self.cache.cache_path(path, 'y', 'x', self.crs_wkt), cache_path)
+        self.assertNotEqual(self.cache.cache_path(path, 'x', 'y', ''), cache_path)
+        self.assertIsNone(self.cache.cache_path(os.path.join(self.root, 'missing.csv'), 'x', 'y', self.crs_wkt))
+
+        self.assertIsNone(self.cache.lookup(path, 'x', 'y', self.crs_wkt))
+        self.assertEqual(self.cache.convert(path, 'x', 'y', FIELD_TYPES, self.crs_wkt, 'source'), cache_path)
+        self.assertEqual(self.cache.lookup(path, 'x', 'y', self.crs_wkt), cache_path)
+
+        self.write('points.csv', 'name,x,y\na,1,2\nb,3,4\n')
+        self.assertNotEqual(self.cache.cache_path(path, 'x', 'y', self.crs_wkt), cache_path)
+        self.assertIsNone(self.cache.lookup(path, 'x', 'y', self.crs_wkt))
+
+    def test_convert_removes_stale_files(self):
+        """Converting a new version of a file removes the cache files of its older versions only."""
+        path = self.write('points.csv', 'name,x,y\na,1,2\n')
+        other_path = self.write('other.csv', 'name,x,y\nc,5,6\n')
+        old_cache_path = self.cache.convert(path, 'x', 'y', FIELD_TYPES, self.crs_wkt, 'source')
+        other_cache_path = self.cache.convert(other_path, 'x', 'y', FIELD_TYPES, self.crs_wkt, 'source')
+
+        self.write('points.csv', 'name,x,y\na,1,2\nb,3,4\n')
+        new_cache_path = self.cache.convert(path, 'x', 'y', FIELD_TYPES, self.crs_wkt, 'source')
+        self.assertNotEqual(new_cache_path, old_cache_path)
+        self.assertEqual(self.cache_files(), sorted(os.path.basename(cache_path)
+                                                    for cache_path in (new_cache_path, other_cache_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
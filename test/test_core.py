@@ -0,0 +1,293 @@
+# coding=utf-8
+"""Tests of the core modules, they run without QGIS.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@alfajer'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2023, alfajer'
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from collections import Counter
+
+from ..csv_dir_index import DirIndex
+from ..csv_preflight import parse_coordinates, preflight, preflight_file
+from ..csv_probe import count_columns, probe_schema, sniff_dialect, validate_file
+from ..csv_reader import convert_value, group_sources, iter_attribute_chunks, merge_field_types
+from ..csv_scanner import filter_paths, find_changes, iter_rescan, iter_scan, list_directory
+from ..csv_schema_cache import SchemaCache
+from ..csv_selection import SelectionModel
+from ..csv_tree_plan import (IMPORT_MERGE_ALL, IMPORT_MERGE_PER_FOLDER, IMPORT_PER_FILE, GroupPlan, import_groups,
+                             plan_tree, top_level_dir)
+
+
+class CoreTest(unittest.TestCase):
+    """Test the scanning, probing, selection and tree planning of CSV files."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.root)
+
+    def write(self, relative_path, text, encoding='utf-8'):
+        """Write a file under the test directory and return its path."""
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wb') as file:
+            file.write(text.encode(encoding))
+        return path
+
+    def test_iter_scan(self):
+        """Only the CSV/TSV files, compressed or in zip archives, are listed."""
+        self.write('a.csv', 'x,y\n1,2\n')
+        self.write('b.txt', 'not listed\n')
+        self.write('sub/c.tsv', 'x\ty\n1\t2\n')
+        self.write('sub/d.csv.gz', 'x,y\n1,2\n')
+        with zipfile.ZipFile(os.path.join(self.root, 'e.zip'), 'w') as archive:
+            archive.writestr('inner/f.csv', 'x,y\n1,2\n')
+        names = sorted(os.path.relpath(path, self.root) for _, _, files in iter_scan(self.root) for path in files)
+        self.assertEqual(names, ['a.csv', os.path.join('e.zip', 'inner', 'f.csv'), os.path.join('sub', 'c.tsv'),
+                                 os.path.join('sub', 'd.csv.gz')])
+
+    def test_directory_named_like_archive(self):
+        """A directory whose name ends with .zip is walked like any directory."""
+        self.write('real.zip/inner.csv', 'x,y\n1,2\n')
+        dir_path = os.path.join(self.root, 'real.zip')
+        self.assertEqual(list_directory(self.root), ([dir_path], []))
+        self.assertEqual(list_directory(dir_path), ([], [os.path.join(dir_path, 'inner.csv')]))
+        self.assertEqual([files for _, _, files in iter_scan(self.root)], [[], [os.path.join(dir_path, 'inner.csv')]])
+
+    def test_rescan_uses_index(self):
+        """A rescan only lists the directories that changed."""
+        self.write('a/one.csv', 'x,y\n1,2\n')
+        self.write('b/two.csv', 'x,y\n1,2\n')
+        index = DirIndex(os.path.join(self.root, 'index', 'dir_index.sqlite'))
+        try:
+            scan_root = os.path.join(self.root, 'a')
+            first = list(iter_rescan(scan_root, index))
+            self.assertTrue(all(changed for _, _, _, changed in first))
+            second = list(iter_rescan(scan_root, index))
+            self.assertFalse(any(changed for _, _, _, changed in second))
+            self.assertEqual(second[0][2], [os.path.join(scan_root, 'one.csv')])
+        finally:
+            index.close()
+
+    def test_delete_subtrees(self):
+        """Only the listings of a removed directory and beneath it are dropped, paths differing by their case or
+        sharing its name as a prefix are kept."""
+        paths = [os.path.join(self.root, *parts) for parts in (('a',), ('a', 'b'), ('A', 'b'), ('a_b',), ('a%',))]
+        index = DirIndex(os.path.join(self.root, 'index', 'dir_index.sqlite'))
+        try:
+            index.put_many([(path, 1, [], []) for path in paths])
+            index.delete_subtrees([paths[0]])
+            self.assertEqual([path for path in paths if index.get(path) is not None], paths[2:])
+        finally:
+            index.close()
+
+    def test_find_changes(self):
+        """The first check records the signatures, the next ones report the new and the modified files."""
+        one = self.write('a/one.csv', 'x,y\n1,2\n')
+        index = DirIndex(os.path.join(self.root, 'index', 'dir_index.sqlite'))
+        try:
+            scan_root = os.path.join(self.root, 'a')
+            signatures = {one: None}
+            self.assertEqual(find_changes(scan_root, index, {one}, signatures), ([scan_root], [], []))
+            self.assertIsNotNone(signatures[one])
+
+            two = self.write('a/two.csv', 'x,y\n1,2\n')
+            self.write('a/one.csv', 'x,y\n1,2\n3,4\n')
+            # the listing is taken from the index while the directory modification time is the same
+            os.utime(scan_root, ns=(1, 1))
+            self.assertEqual(find_changes(scan_root, index, {one}, signatures), ([scan_root], [two], [one]))
+            self.assertEqual(find_changes(scan_root, index, {one, two}, signatures), ([scan_root], [], []))
+        finally:
+            index.close()
+
+    def test_find_changes_after_detection(self):
+        """A new file still being written when it's found is reported as modified once it grew."""
+        index = DirIndex(os.path.join(self.root, 'index', 'dir_index.sqlite'))
+        try:
+            scan_root = os.path.join(self.root, 'uploads')
+            os.makedirs(scan_root)
+            signatures = {}
+            self.assertEqual(find_changes(scan_root, index, set(), signatures), ([scan_root], [], []))
+            path = self.write('uploads/data.csv', 'x,y\n')
+            os.utime(scan_root, ns=(1, 1))
+            self.assertEqual(find_changes(scan_root, index, set(), signatures), ([scan_root], [path], []))
+            self.write('uploads/data.csv', 'x,y\n1,2\n')
+            self.assertEqual(find_changes(scan_root, index, {path}, signatures), ([scan_root], [], [path]))
+        finally:
+            index.close()
+
+    def test_filter_paths(self):
+        """Include & exclude patterns match names and relative paths."""
+        paths = [os.path.join(self.root, name) for name in ('a.csv', os.path.join('2023', 'b.csv'), 'tmp_c.csv')]
+        self.assertEqual(filter_paths(paths, self.root, ['2023/*']), paths[1:2])
+        self.assertEqual(filter_paths(paths, self.root, exclude=['tmp_*']), paths[:2])
+
+    def test_sniff_dialect(self):
+        """The delimiter, quote and encoding are sniffed."""
+        path = self.write('semicolon.csv', 'name;x;y\n"é;1";1,5;2\nb;3;4\n', 'cp1252')
+        dialect = sniff_dialect(path)
+        self.assertEqual(dialect['delimiter'], ';')
+        self.assertEqual(dialect['encoding'], 'cp1252')
+
+    def test_probe_schema(self):
+        """The header, field types and coordinates fields of a file are probed and cached."""
+        path = self.write('points.csv', 'name,lon,lat\na,10.5,20.5\nb,11.5,21.5\n')
+        cache = SchemaCache(os.path.join(self.root, 'cache', 'schema_cache.sqlite'))
+        try:
+            schema = probe_schema(path, cache)
+            self.assertEqual(schema['header'], ['name', 'lon', 'lat'])
+            self.assertEqual(schema['field_types'], ['text', 'double', 'double'])
+            self.assertEqual((schema['x_field'], schema['y_field']), ('lon', 'lat'))
+            self.assertEqual(cache.get(path)['header'], schema['header'])
+        finally:
+            cache.close()
+
+    def test_count_columns_fills_cache(self):
+        """Headers read while browsing are cached, a second browse doesn't read the files."""
+        paths = [self.write('a.csv', 'x,y\n1,2\n'), self.write('b.csv', 'x,z\n1,2\n')]
+        cache = SchemaCache(os.path.join(self.root, 'cache', 'schema_cache.sqlite'))
+        try:
+            counts, file_count = count_columns(paths, cache)
+            self.assertEqual((counts, file_count), ({'x': 2, 'y': 1, 'z': 1}, 2))
+            self.assertEqual(cache.get(paths[1])['header'], ['x', 'z'])
+        finally:
+            cache.close()
+
+    def test_truncated_compressed_file(self):
+        """A truncated gzip file has no header, the other files are probed and validated."""
+        path = self.write('truncated.csv.gz', 'x,y\n' + '1,2\n' * 1000)
+        with open(path, 'rb') as file:
+            data = file.read()
+        with open(path, 'wb') as file:
+            file.write(data[:len(data) // 2])
+        paths = [path, self.write('ok.csv', 'x,y\n1,2\n')]
+        self.assertEqual(sniff_dialect(path)['delimiter'], ',')
+        self.assertEqual(count_columns(paths), (Counter({'x': 1, 'y': 1}), 1))
+        self.assertEqual(validate_file(path, 'x', 'y'), 'no header')
+
+    def test_validate_file(self):
+        """The reason a file can't be loaded is returned."""
+        self.assertIsNone(validate_file(self.write('ok.csv', 'x,y\n1,2\n'), 'x', 'y'))
+        self.assertEqual(validate_file(self.write('no_xy.csv', 'a,b\n1,2\n'), 'x', 'y'),
+                         'missing coordinates columns')
+        self.assertEqual(validate_file(self.write('empty.csv', ''), 'x', 'y'), 'no header')
+
+    def test_parse_coordinates(self):
+        """Values which aren't numbers are nan, the others are parsed as they are."""
+        values = parse_coordinates(['1.5', '', 'abc', 'inf', '-2'])
+        self.assertEqual(values[0], 1.5)
+        self.assertEqual(values[4], -2)
+        self.assertTrue(all(value != value for value in values[1:3]))
+        self.assertEqual(values[3], float('inf'))
+
+    def test_preflight_file(self):
+        """Rows without finite coordinates are counted, the extent covers the valid ones, chunk after chunk."""
+        path = self.write('points.csv', 'name,x,y\na,1,10\nb,nan,11\nc,inf,12\nd\ne,,13\nf,-3,14.5\ng,2,abc\n')
+        for chunk_rows in (2, 1000):
+            stats = preflight_file(path, 'x', 'y', chunk_rows=chunk_rows)
+            self.assertEqual(stats, {'row_count': 7, 'invalid_count': 5, 'extent': [-3.0, 10.0, 1.0, 14.5]})
+        self.assertIsNone(preflight_file(path, 'x', 'missing'))
+
+    def test_preflight_without_valid_rows(self):
+        """A file without any valid coordinates has no extent, its preflight is cached per fields."""
+        path = self.write('empty_xy.csv', 'x,y\n,\na,b\n')
+        cache = SchemaCache(os.path.join(self.root, 'cache', 'schema_cache.sqlite'))
+        try:
+            stats = preflight(path, 'x', 'y', cache)
+            self.assertEqual((stats['row_count'], stats['invalid_count'], stats['extent']), (2, 2, None))
+            self.assertEqual(cache.get(path)['preflight']['x_field'], 'x')
+        finally:
+            cache.close()
+
+    def test_merge_field_types(self):
+        """Columns of merged files are united in order, mixed numbers are double and other mixes are text."""
+        schemas = [{'header': ['x', 'y', 'id', 'name'], 'field_types': ['double', 'double', 'integer', 'text']},
+                   {'header': ['x', 'y', 'id', 'name', 'depth'],
+                    'field_types': ['double', 'integer', 'text', 'text', 'integer']}]
+        self.assertEqual(merge_field_types(schemas), [('x', 'double'), ('y', 'double'), ('id', 'text'),
+                                                      ('name', 'text'), ('depth', 'integer')])
+
+    def test_convert_value(self):
+        """Values are converted to their field type, empty or unconvertible values are None."""
+        self.assertEqual(convert_value('12', 'integer'), 12)
+        self.assertEqual(convert_value('12.0', 'integer'), 12)
+        self.assertIsNone(convert_value('12.5', 'integer'))
+        self.assertEqual(convert_value('1e3', 'double'), 1000.0)
+        self.assertIsNone(convert_value('abc', 'double'))
+        self.assertIsNone(convert_value('', 'text'))
+        self.assertEqual(convert_value('007', 'text'), '007')
+
+    def test_iter_attribute_chunks(self):
+        """Rows follow the merged field types, the columns missing from a file are None and the file path comes
+        last, rows without coordinates are skipped."""
+        path = self.write('points.csv', 'name,x,y,id\na,1,2,3\nb,nan,2,4\nc,5,6\nd,7,8,x\n')
+        field_types = [('x', 'double'), ('y', 'double'), ('depth', 'double'), ('id', 'integer'), ('name', 'text')]
+        chunks = list(iter_attribute_chunks(path, 'x', 'y', field_types, chunk_rows=2))
+        self.assertEqual([len(rows) for rows in chunks], [2, 1])
+        self.assertEqual(chunks[0][0], (1.0, 2.0, [1.0, 2.0, None, 3, 'a', path]))
+        self.assertEqual(chunks[0][1][2], [5.0, 6.0, None, None, 'c', path])
+        self.assertEqual(chunks[1][0][2][3:5], [None, 'd'])
+        self.assertEqual(list(iter_attribute_chunks(path, 'x', 'missing', field_types)), [])
+
+    def test_group_sources(self):
+        """The files of a group without the coordinates fields are left out, unless their fields are detected."""
+        paths = [self.write('a.csv', 'x,y\n1,2\n'), self.write('b.csv', 'lon,lat\n10.5,20.5\n'),
+                 self.write('c.csv', 'name\na\n')]
+        sources, failed = group_sources(paths, 'x', 'y')
+        self.assertEqual([(path, x_field, y_field) for path, x_field, y_field, _ in sources], [(paths[0], 'x', 'y')])
+        self.assertEqual(failed, paths[1:])
+        sources, failed = group_sources(paths, 'x', 'y', detect_xy=True)
+        self.assertEqual([(x_field, y_field) for _, x_field, y_field, _ in sources], [('x', 'y'), ('lon', 'lat')])
+        self.assertEqual(sources[1][3]['header'], ['lon', 'lat'])
+        self.assertEqual(failed, paths[2:])
+
+    def test_selection_subtree(self):
+        """Selecting a directory selects every listed file beneath it."""
+        selection = SelectionModel()
+        selection.register('/r', ['/r/a'], ['/r/1.csv'])
+        selection.register('/r/a', [], ['/r/a/2.csv'])
+        selection.select_subtree('/r')
+        self.assertEqual(selection.files, ['/r/1.csv', '/r/a/2.csv'])
+        selection.deselect_subtree('/r/a')
+        self.assertEqual(selection.files, ['/r/1.csv'])
+        self.assertFalse(selection.has_dir('/r/a'))
+
+    def test_import_groups(self):
+        """Files are grouped per file, per folder or all together."""
+        paths = [os.path.join('r', 'a', '1.csv'), os.path.join('r', 'a', '2.csv.gz'), os.path.join('r', '3.tsv')]
+        self.assertEqual([name for _, name, _ in import_groups(paths, IMPORT_PER_FILE)], ['1', '2', '3'])
+        self.assertEqual([files for _, _, files in import_groups(paths, IMPORT_MERGE_PER_FOLDER)],
+                         [paths[:2], paths[2:]])
+        self.assertEqual(import_groups(paths, IMPORT_MERGE_ALL), [('r', 'r', paths)])
+
+    def test_plan_tree(self):
+        """Groups are planned from the paths, in the order of the files."""
+        paths = [os.path.join('r', 'a', 'b', '1.csv'), os.path.join('r', '2.csv'), os.path.join('r', 'a', '3.csv')]
+        top_level_path = top_level_dir(paths)
+        plan = plan_tree(top_level_path, [(os.path.dirname(path), path) for path in paths])
+        self.assertEqual([group.path for group in plan.iter_groups()],
+                         ['r', os.path.join('r', 'a'), os.path.join('r', 'a', 'b')])
+        self.assertEqual([child.name if isinstance(child, GroupPlan) else child for child in plan.children],
+                         ['a', paths[1]])
+        self.assertEqual(top_level_dir(paths[:1]), os.path.join('r', 'a', 'b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# coding=utf-8
+"""Tests of the GeoPackage writer, they need GDAL.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@alfajer'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2023, alfajer'
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from osgeo import ogr, osr
+    from ..csv_gpkg import GeoPackageWriter, table_field_names
+    from ..csv_probe import probe_schema
+    from ..csv_reader import merge_field_types
+except ImportError:
+    # GDAL isn't available
+    ogr = None
+
+SOURCE_FIELD = 'source_file'
+
+
+@unittest.skipIf(ogr is None, 'GDAL is not available')
+class GeoPackageWriterTest(unittest.TestCase):
+    """Test the files are written whole in the tables, whatever their columns."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.root = tempfile.mkdtemp()
+        self.gpkg_path = os.path.join(self.root, 'out.gpkg')
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        self.crs_wkt = srs.ExportToWkt()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        """Write a file under the test directory and return its path."""
+        path = os.path.join(self.root, name)
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wb') as file:
+            file.write(text.encode('utf-8'))
+        return path
+
+    def write_table(self, paths):
+        """Write the files in one table and return the names of the files which failed."""
+        field_types = merge_field_types(probe_schema(path) for path in paths)
+        writer = GeoPackageWriter(self.gpkg_path, self.crs_wkt)
+        failed = []
+        try:
+            writer.create_table('points', field_types, SOURCE_FIELD)
+            for path in paths:
+                try:
+                    writer.add_file(path, 'x', 'y', field_types)
+                except (OSError, EOFError):
+                    failed.append(os.path.basename(path))
+            writer.finish_table()
+        finally:
+            writer.close()
+        return failed
+
+    def table_rows(self):
+        """Return the number of rows of each source file in the table."""
+        dataset = ogr.Open(self.gpkg_path)
+        counts = {}
+        for feature in dataset.GetLayerByName('points'):
+            name = os.path.basename(feature.GetField(SOURCE_FIELD))
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def test_table_field_names(self):
+        """Names taken by the table columns or by a previous field are suffixed."""
+        self.assertEqual(table_field_names(['FID', 'geom', 'name', 'Name', SOURCE_FIELD, ''], [SOURCE_FIELD]),
+                         ['FID_2', 'geom_2', 'name', 'Name_2', f'{SOURCE_FIELD}_2', 'field'])
+
+    def test_colliding_columns(self):
+        """The rows of a file having fid and geom columns, e.g. exported by QGIS, are all written."""
+        path = self.write('export.csv', 'fid,geom,x,y\n1,POINT (1 2),1,2\n1,POINT (3 4),3,4\n')
+        self.assertEqual(self.write_table([path]), [])
+        self.assertEqual(self.table_rows(), {'export.csv': 2})
+
+    def test_truncated_file_rows_removed(self):
+        """The rows of a file failing midway are removed from the table, the other files are kept."""
+        path = self.write('truncated.csv.gz', 'x,y\n' + '1,2\n' * 50000)
+        with open(path, 'rb') as file:
+            data = file.read()
+        with open(path, 'wb') as file:
+            file.write(data[:len(data) * 3 // 4])
+        other_path = self.write('other.csv', 'x,y\n5,6\n')
+        self.assertEqual(self.write_table([other_path, path]), ['truncated.csv.gz'])
+        self.assertEqual(self.table_rows(), {'other.csv': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
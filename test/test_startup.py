@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Startup cost of the plugin when QGIS loads it.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'info@alfajer'
+__date__ = '2026-10-18'
+__copyright__ = 'Copyright 2023, alfajer'
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from .utilities import get_qgis_app
+
+# all None without QGIS
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+
+# package of the plugin, the parent of the test package
+PLUGIN_PACKAGE = __package__.rpartition('.')[0]
+# directory the plugin package is imported from
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.pardir] * (PLUGIN_PACKAGE.count('.') + 2)))
+# seconds classFactory & the first initGui may take, the modules of the plugin not being imported yet
+STARTUP_BUDGET = 0.05
+# modules only needed to scan, read or import files, none of them is imported when QGIS loads the plugin
+HEAVY_MODULES = ('numpy', 'osgeo', 'pyarrow', 'sqlite3', 'zipfile', 'zstandard')
+
+# run in a new interpreter: QGIS is started, then the plugin is loaded like QGIS does when it starts
+STARTUP_SCRIPT = '''
+import json, sys, time
+from {package}.test.utilities import get_qgis_app
+QGIS_APP, CANVAS, IFACE, PARENT = get_qgis_app()
+loaded_modules = set(sys.modules)
+start = time.perf_counter()
+from {package} import classFactory
+plugin = classFactory(IFACE)
+plugin.initGui()
+duration = time.perf_counter() - start
+print(json.dumps({{'duration': duration, 'modules': sorted(set(sys.modules) - loaded_modules)}}))
+plugin.unload()
+'''
+
+
+@unittest.skipIf(IFACE is None, 'QGIS is not available')
+class StartupTest(unittest.TestCase):
+    """Test the plugin loads nothing but its action when QGIS starts."""
+
+    def test_cold_start(self):
+        """classFactory and the first initGui stay within their budget and import none of the heavy modules,
+        the dialog nor the Qt resources."""
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT.format(package=PLUGIN_PACKAGE)],
+                                cwd=PACKAGE_ROOT, capture_output=True, text=True, check=True).stdout
+        # QGIS may print its own messages first
+        result = json.loads(output.strip().splitlines()[-1])
+        self.assertLess(result['duration'], STARTUP_BUDGET)
+        imported = {module.partition('.')[0] for module in result['modules']}
+        self.assertFalse(imported.intersection(HEAVY_MODULES))
+        # the dialog, its .ui file and the Qt resources wait for the first run()
+        self.assertNotIn(f'{PLUGIN_PACKAGE}.csv_layers_list_dialog', result['modules'])
+        self.assertNotIn(f'{PLUGIN_PACKAGE}.resources', result['modules'])
+
+
+if __name__ == '__main__':
+    unittest.main()